@@ -1,33 +1,299 @@
 """Modifications of ArchiveBase for BBQ Features."""
 
+import copy
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
 import numpy as np
 from ribs.archives._add_status import AddStatus
 from ribs.archives._archive_base import ArchiveBase
+from ribs.archives._archive_stats import ArchiveStats
+
+
+EliteBatch = namedtuple("EliteBatch", ["sol", "obj", "beh", "idx", "meta"])
+EliteBatch.__doc__ = """Several elites, the fields of :class:`ribs.archives.Elite`
+as arrays with one entry per elite. ``idx`` is a tuple with one index array per
+storage dimension, ``sol`` an object array in archives of objects."""
+
+
+def own_metadata(metadata):
+    """ Copy of array metadata that is a view, e.g. a row of the metadata of
+    a whole batch, so that the elite does not keep the batch alive """
+    if isinstance(metadata, np.ndarray) and metadata.base is not None:
+        return metadata.copy()
+    return metadata
 
 
 class BBQArchiveBase(ArchiveBase):
+    # Solutions and behaviors in ram unless _set_storage says otherwise
+    storage = "ram"
+    memmap_behaviors = False
+    storage_dir = None
+    # Storage arrays RibsLogger.plot_obj reads, copied into snapshots
+    plot_arrays = ("_occupied", "_objective_values")
+
     def __init__(self, storage_dims, behavior_dim, seed=None, dtype=np.float64):
         super().__init__(storage_dims, behavior_dim, seed, dtype)
 
+    def _set_storage(self, storage="ram", memmap_behaviors=False,
+                     storage_dir=None):
+        """Chooses where solutions and behaviors are stored.
+
+        Args:
+            storage (str): ``"ram"`` for numpy arrays, ``"memmap"`` to keep
+                solutions in a memory mapped file in ``storage_dir``, so only
+                the bins in use take up memory.
+            memmap_behaviors (bool): Memory map behavior values too.
+            storage_dir (str or Path): Folder of the memory mapped files, a
+                temporary folder if None.
+        """
+        if storage not in ("ram", "memmap"):
+            raise ValueError(f"Unknown archive storage '{storage}', "
+                             "use 'ram' or 'memmap'")
+        if storage == "memmap" and self.use_objects:
+            raise ValueError("Objects cannot be stored in a memory map, use "
+                             "storage 'ram' with use_objects")
+        self.storage = storage
+        self.memmap_behaviors = memmap_behaviors
+        self.storage_dir = storage_dir
+
     def initialize(self, solution_dim):
+        # Solutions are allocated below, not as a dense array by ArchiveBase
+        super().initialize(0)
         if self.use_objects is True:
             self._sol_dtype = object
-            super().initialize(1)
+            self._solution_dim = 1
         else:
             self._sol_dtype = self.dtype
-            super().initialize(solution_dim)            
-        self._solutions = np.empty((*self._storage_dims, solution_dim),
-                            dtype=self._sol_dtype)
+            self._solution_dim = solution_dim
+        self._solutions = self._storage_array(
+            'solutions', (*self._storage_dims, solution_dim), self._sol_dtype)
+        if self.memmap_behaviors:
+            self._behavior_values = self._storage_array(
+                'behaviors', (*self._storage_dims, self._behavior_dim),
+                self.dtype)
         self._objective_values = np.full((self._storage_dims), np.nan)                            
+        self._changed = np.zeros(self._storage_dims, dtype=bool)
+        self._reset_occupied_array()
+
+    def _storage_array(self, name, shape, dtype):
+        """ Empty storage array, memory mapped to `<storage_dir>/<name>.dat`
+        with memmap storage. Pages of the file are only written (and held in
+        memory) once a bin is used. """
+        if self.storage == "ram":
+            return np.empty(shape, dtype=dtype)
+        if self.storage_dir is None:
+            self.storage_dir = tempfile.mkdtemp(prefix='bbq_archive_')
+        Path(self.storage_dir).mkdir(parents=True, exist_ok=True)
+        return np.memmap(Path(self.storage_dir) / f'{name}.dat', dtype=dtype,
+                         mode='w+', shape=shape)
+
+    def sample_elites(self, n, weights=None):
+        """Draws ``n`` elites with replacement, in one call.
+
+        Args:
+            n (int): Number of elites.
+            weights (numpy.ndarray): Optional non-negative weight of each
+                elite, in the order of ``_occupied_indices``, to draw them in
+                proportion to (e.g. fitness or curiosity). Uniform if None.
+        Returns:
+            EliteBatch: The elites drawn.
+        Raises:
+            IndexError: The archive is empty.
+        """
+        if self.empty:
+            raise IndexError("No elements in archive.")
+        occupied = self._occupied_array()
+        if weights is None:
+            pick = self._rng.integers(occupied.shape[1], size=n)
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            pick = self._rng.choice(occupied.shape[1], size=n,
+                                    p=weights / weights.sum())
+        index = tuple(occupied[:, pick])
+        sols = np.asarray(self._solutions[index])
+        if self.use_objects:
+            sols = sols[:, 0]
+        return EliteBatch(sols, self._objective_values[index],
+                          np.asarray(self._behavior_values[index]), index,
+                          self._metadata[index])
+
+    def _occupied_array(self):
+        """``_occupied_indices_cols`` as an ``(storage dims, n_elites)`` int
+        array. The lists only grow until the archive is cleared, so only
+        indices added since the last call are copied."""
+        cols = self._occupied_indices_cols
+        if self._occ_clear != self._state["clear"]:
+            self._reset_occupied_array()
+        n, n_old = len(cols[0]), self._occ_n
+        if n > self._occ_array.shape[1]:
+            grown = np.empty((len(cols), max(n, 2 * self._occ_array.shape[1])),
+                             dtype=int)
+            grown[:, :n_old] = self._occ_array[:, :n_old]
+            self._occ_array = grown
+        if n > n_old:
+            for i, col in enumerate(cols):
+                self._occ_array[i, n_old:n] = col[n_old:n]
+            self._occ_n = n
+        return self._occ_array[:, :n]
+
+    def _reset_occupied_array(self):
+        self._occ_array = np.empty((len(self._storage_dims), 0), dtype=int)
+        self._occ_n = 0
+        self._occ_clear = self._state["clear"]
+
+    def flush(self):
+        """Writes memory mapped storage to disk, nothing to do in ram"""
+        for array in (self._solutions, self._behavior_values):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def get_index_batch(self, behavior_values):
+        """Returns archive indices for a batch of behavior values.
+
+        Fallback that calls :meth:`get_index` on each row -- archives that can
+        compute their indices in one numpy call should override this.
+
+        Args:
+            behavior_values (numpy.ndarray): ``(n, behavior_dim)`` array of
+                coordinates in behavior space.
+        Returns:
+            tuple of numpy.ndarray: One int array of length ``n`` per storage
+            dimension, i.e. in the same column-wise form as
+            ``_occupied_indices_cols``.
+        """
+        index = np.empty((len(behavior_values), len(self._storage_dims)), int)
+        for i, beh in enumerate(behavior_values):
+            index[i] = self.get_index(beh)
+        return tuple(index.T)
 
     def add_batch(self, xx, objs, descs, meta=None):
-        """ Add set of solutions at once"""
-        if meta is not None:
-            for i in range(len(objs)):
-                self.add(xx[i], objs[i], descs[i], metadata=meta[i])
+        """Attempts to insert a batch of solutions into the archive at once.
+
+        Bin indices are computed for the whole batch in one call. If several
+        solutions land in the same bin only the best of them competes with the
+        current elite, and the winners are scattered into the storage arrays
+        with fancy indexing.
+
+        Args:
+            xx (array-like): ``(n, solution_dim)`` solutions, or a length ``n``
+                sequence of objects if the archive ``use_objects``.
+            objs (array-like): ``(n,)`` objective values.
+            descs (array-like): ``(n, behavior_dim)`` behavior values.
+            meta (sequence): Optional metadata object for each solution.
+        Returns:
+            tuple: ``(status, value)`` arrays of length ``n``, with the same
+            meaning as in :meth:`add`. Statuses are relative to the archive
+            before the batch, except that a solution beaten by another one
+            from the same batch is ``NOT_ADDED``, with its value measured
+            against that winner.
+        """
+        if type(self).insert is not BBQArchiveBase.insert:
+            # Custom insertion rules are only defined one solution at a time
+            return self._add_batch_serial(xx, objs, descs, meta)
+
+        self._state["add"] += 1
+        objs = np.asarray(objs, dtype=self.dtype).reshape(-1)
+        n = len(objs)
+        status = np.full(n, AddStatus.NOT_ADDED, dtype=np.int32)
+        value = np.zeros(n, dtype=self.dtype)
+        if n == 0:
+            return status, value
+        descs = np.asarray(descs, dtype=self.dtype).reshape(n, -1)
+
+        # Solutions with any nan behavior value are skipped
+        valid = np.flatnonzero(~np.isnan(descs).any(axis=1))
+        if len(valid) == 0:
+            return status, value
+        index = self.get_index_batch(descs[valid])
+        bins = np.ravel_multi_index(index, self._storage_dims)
+
+        # Best solution per bin within the batch: sort by bin, then by
+        # descending objective, and keep the first of each run.
+        order = np.lexsort((-objs[valid], bins))
+        first = np.r_[True, bins[order][1:] != bins[order][:-1]]
+        best = order[first]
+        best_of_bin = np.repeat(best, np.diff(np.r_[np.flatnonzero(first),
+                                                    len(order)]))
+        best_obj = np.empty(len(valid), dtype=self.dtype)
+        best_obj[order] = objs[valid][best_of_bin]
+
+        # Compare batch winners with the current elites
+        win_index = tuple(col[best] for col in index)
+        old_obj = self._objective_values[win_index]
+        occupied = self._occupied[win_index]
+        inserted = ~occupied | (old_obj < objs[valid][best])
+        is_new = inserted & ~occupied
+
+        # Values are relative to whatever holds the bin after the batch
+        old_all = np.empty(len(valid), dtype=self.dtype)
+        old_all[best] = np.where(occupied, old_obj, np.nan)
+        old_all[order] = old_all[best_of_bin]
+        kept_all = np.where(np.isnan(old_all), best_obj,
+                            np.fmax(old_all, best_obj))
+        value[valid] = objs[valid] - kept_all
+
+        winners = valid[best[inserted]]
+        status[valid[best[is_new]]] = AddStatus.NEW
+        status[valid[best[inserted & occupied]]] = AddStatus.IMPROVE_EXISTING
+        value[winners] = objs[winners] - np.where(is_new, 0, old_obj)[inserted]
+        if len(winners) == 0:
+            return status, value
+
+        # Scatter winners into storage
+        ins_index = tuple(col[best[inserted]] for col in index)
+        self._occupied[ins_index] = True
+        self._changed[ins_index] = True
+        self._objective_values[ins_index] = objs[winners]
+        self._behavior_values[ins_index] = descs[winners]
+        if self.use_objects:
+            sols = np.empty(len(winners), dtype=object)
+            for i, w in enumerate(winners):
+                sols[i] = xx[w]
+            self._solutions[ins_index + (0,)] = sols
         else:
-            for i in range(len(objs)):
-                self.add(xx[i], objs[i], descs[i])   
+            self._solutions[ins_index] = np.asarray(xx)[winners]
+        for i, w in enumerate(winners):
+            self._metadata[tuple(col[i] for col in ins_index)] = (
+                None if meta is None else own_metadata(meta[w]))
+
+        # Grids index with tuples, CVTs with a single int (as in get_index)
+        is_grid = hasattr(self, 'boundaries')
+        for new_index in zip(*(col[is_new[inserted]] for col in ins_index)):
+            new_index = tuple(int(i) for i in new_index)
+            self._add_occupied_index(new_index if is_grid else new_index[0])
+        self._stats_update_batch(np.where(is_new, 0, old_obj)[inserted],
+                                 objs[winners])
+        return status, value
+
+    def _add_batch_serial(self, xx, objs, descs, meta=None):
+        """ Adds solutions one at a time with :meth:`add` """
+        status = np.empty(len(objs), dtype=np.int32)
+        value = np.empty(len(objs), dtype=self.dtype)
+        for i in range(len(objs)):
+            m = None if meta is None else meta[i]
+            status[i], value[i] = self.add(xx[i], objs[i], descs[i],
+                                           metadata=m)
+        return status, value
+
+    def _stats_update_batch(self, old_objs, new_objs):
+        """Updates the archive stats after replacing old_objs with new_objs.
+
+        Batched version of ``_stats_update``, for a new bin pass an old
+        objective of 0.
+        """
+        new_qd_score = (self._stats.qd_score +
+                        self.dtype(np.sum(new_objs) - np.sum(old_objs)))
+        batch_max = self.dtype(np.max(new_objs))
+        self._stats = ArchiveStats(
+            num_elites=len(self),
+            coverage=self.dtype(len(self) / self.bins),
+            qd_score=new_qd_score,
+            obj_max=batch_max if self._stats.obj_max is None else max(
+                self._stats.obj_max, batch_max),
+            obj_mean=new_qd_score / self.dtype(len(self)),
+        )
 
     #@require_init
     def add(self, solution, objective_value, behavior_values, metadata=None):
@@ -100,7 +366,8 @@ class BBQArchiveBase(ArchiveBase):
             self._solutions, self._objective_values, self._behavior_values)
 
         if was_inserted:
-            self._metadata[index] = metadata
+            self._metadata[index] = own_metadata(metadata)
+            self._changed[index] = True
 
         return was_inserted, already_occupied
 
@@ -136,4 +403,81 @@ class BBQArchiveBase(ArchiveBase):
 
             return True, already_occupied
 
-        return False, already_occupied
\ No newline at end of file
+        return False, already_occupied
+
+    def pop_changes(self):
+        """Flat indices of the bins written to since the last call.
+
+        Every insert marks its bin, so checkpoints only need to store these.
+        """
+        changed = np.flatnonzero(self._changed)
+        self._changed[:] = False
+        return changed
+
+    def snapshot(self):
+        """Copy of the archive to plot, that is not changed by later adds.
+
+        Only the storage arrays in ``plot_arrays`` and the index lists are
+        copied, everything else (solutions, behaviors and metadata unless
+        plotted, centroids, boundaries) is shared and keeps changing. Use it
+        to plot the archive on another thread while the search keeps adding
+        to this one. Memory mapped arrays are too large to copy and are
+        shared as well, so they are not frozen in the snapshot.
+        """
+        snap = copy.copy(self)
+        for attr in self.plot_arrays:
+            array = getattr(self, attr)
+            if not isinstance(array, np.memmap):
+                setattr(snap, attr, array.copy())
+        snap._occupied_indices = list(self._occupied_indices)
+        snap._occupied_indices_cols = tuple(
+            list(col) for col in self._occupied_indices_cols)
+        snap._state = dict(self._state)
+        return snap
+
+    def get_state(self):
+        """Storage arrays, stats and random number generator states, everything
+        :meth:`set_state` needs to continue exactly where this archive is.
+
+        Solutions and behaviors are only kept for occupied bins, the other
+        arrays are not copied.
+        """
+        buf = self._rand_buf
+        occupied = self._occupied
+        return {'occupied': occupied,
+                'solutions': self._solutions[occupied],
+                'objective_values': self._objective_values,
+                'behavior_values': self._behavior_values[occupied],
+                'metadata': self._metadata,
+                'changed': self._changed,
+                'occupied_indices_cols': np.array(self._occupied_indices_cols,
+                                                  dtype=int),
+                'stats': self._stats._asdict(),
+                'state': dict(self._state),
+                'rng': self._rng.bit_generator.state,
+                'rand_buf': {'rng': buf._rng.bit_generator.state,
+                             'buffer': buf._buffer,
+                             'buf_idx': buf._buf_idx}}
+
+    def set_state(self, state):
+        """Restores a state from :meth:`get_state` into this initialized
+        archive of the same shape."""
+        for attr in ('occupied', 'objective_values', 'metadata', 'changed'):
+            getattr(self, '_' + attr)[...] = state[attr]
+        self._solutions[self._occupied] = state['solutions']
+        self._behavior_values[self._occupied] = state['behavior_values']
+        cols = state['occupied_indices_cols'].tolist()
+        self._occupied_indices_cols = tuple(cols)
+        # Grids index with tuples, CVTs with a single int (as in get_index)
+        if hasattr(self, 'boundaries'):
+            self._occupied_indices = list(zip(*cols))
+        else:
+            self._occupied_indices = list(cols[0])
+        self._stats = ArchiveStats(**state['stats'])
+        self._state = dict(state['state'])
+        self._reset_occupied_array()
+        self._rng.bit_generator.state = state['rng']
+        buf = self._rand_buf
+        buf._rng.bit_generator.state = state['rand_buf']['rng']
+        buf._buffer = np.array(state['rand_buf']['buffer'])
+        buf._buf_idx = state['rand_buf']['buf_idx']
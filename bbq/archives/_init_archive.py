@@ -1,33 +1,230 @@
 """ BBQ Archive versions. """
 
-
+import numpy as np
 from bbq.archives._archive_base import BBQArchiveBase
+from bbq.archives.centroids import CACHE_DIR, cached_centroids, make_centroids
 from ribs.archives._cvt_archive import CVTArchive
-from ribs.archives._grid_archive import GridArchive
+from ribs.archives._grid_archive import GridArchive, _EPSILON
+from ribs.archives._elite import Elite
+from scipy.spatial import cKDTree
 
 #class BbqGrid(GridArchive, BBQArchiveBase):
 class BbqGrid(BBQArchiveBase, GridArchive):
-    def __init__(self, grid_res=None, desc_bounds=None, seed=None, use_objects=False, **_):    
+    def __init__(self, grid_res=None, desc_bounds=None, seed=None, use_objects=False,
+                 storage="ram", memmap_behaviors=False, storage_dir=None, **_):
         self.use_objects = use_objects
+        self._set_storage(storage, memmap_behaviors, storage_dir)
         super().__init__(grid_res, desc_bounds)
         #self.initialize = BBQArchiveBase.initialize
 
+    def get_index_batch(self, behavior_values):
+        """ Grid indices of a whole batch of behaviors, same rule as get_index """
+        behavior_values = np.minimum(
+            np.maximum(behavior_values + _EPSILON, self._lower_bounds),
+            self._upper_bounds - _EPSILON)
+        index = ((behavior_values - self._lower_bounds) / self._interval_size 
+                 * self._dims).astype(np.int32)
+        return tuple(index.T)
+
+
+# - Nearest centroid search ---------------------------------------------------#
+def nearest_brute(archive, behavior_values):
+    """ Exact differences to every centroid at once, (batch, n_bins, dims)
+    floats of memory """
+    distances = ((behavior_values[:, None, :] - archive._centroids)**2)
+    return np.argmin(distances.sum(axis=2), axis=1)
+
+def nearest_kd(archive, behavior_values):
+    """ Query of the k-d tree over the centroids built when initialized """
+    return archive._centroid_kd_tree.query(behavior_values)[1]
+
+def nearest_chunked(archive, behavior_values):
+    """ Distances as |c|^2 - 2 x.c (the |x|^2 term does not change the
+    nearest centroid) with one matrix product per chunk of `index_chunk`
+    behaviors, so memory stays at (index_chunk, n_bins) floats """
+    centroids = archive._centroids
+    sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    chunk = archive.index_chunk or max(1, 2**22 // len(centroids))
+    index = np.empty(len(behavior_values), dtype=int)
+    for start in range(0, len(behavior_values), chunk):
+        x = behavior_values[start:start+chunk]
+        index[start:start+chunk] = np.argmin(sq_norms - 2 * x @ centroids.T,
+                                             axis=1)
+    return index
+
+cvt_index_lookup = {'brute'  : nearest_brute,
+                    'kd'     : nearest_kd,
+                    'chunked': nearest_chunked}
+
 
 class BbqCVT(BBQArchiveBase, CVTArchive):
-    def __init__(self, n_bins=None, desc_bounds=None, seed=None, use_objects=False, **_):    
+    def __init__(self, n_bins=None, desc_bounds=None, seed=None, use_objects=False,
+                 storage="ram", memmap_behaviors=False, storage_dir=None,
+                 centroid_index="kd", index_chunk=None, samples=100_000,
+                 centroid_cache=CACHE_DIR, custom_centroids=None, **_):
         self.use_objects = use_objects
+        self._set_storage(storage, memmap_behaviors, storage_dir)
+        if centroid_index not in cvt_index_lookup:
+            raise ValueError(f"Unknown centroid_index '{centroid_index}', use "
+                             f"one of {list(cvt_index_lookup)}")
+        self.centroid_index = centroid_index # nearest centroid search
+        self.index_chunk = index_chunk  # behaviors per chunk, None for auto
         super().__init__(n_bins, desc_bounds)
+        self._use_kd_tree = centroid_index == 'kd' # tree built by initialize
+        # k-means here rather than in initialize, from the cache if enabled
+        if custom_centroids is not None:
+            self._centroids = np.asarray(custom_centroids, dtype=self.dtype)
+        elif centroid_cache:
+            self._centroids = cached_centroids(n_bins, desc_bounds, samples,
+                                               seed, centroid_cache)
+        else:
+            self._centroids = make_centroids(n_bins, desc_bounds, samples, seed)
         #self.initialize = BBQArchiveBase.initialize
 
+    def get_index_batch(self, behavior_values):
+        """ Nearest centroid of a whole batch of behaviors in one query """
+        behavior_values = np.asarray(behavior_values, dtype=self.dtype)
+        index = cvt_index_lookup[self.centroid_index](self, behavior_values)
+        return (np.asarray(index, dtype=int),)
+
+    def get_index(self, behavior_values):
+        return int(self.get_index_batch(np.asarray(behavior_values)[None])[0][0])
+
+    def get_state(self):
+        """ As BBQArchiveBase, plus the centroids k-means found """
+        state = super().get_state()
+        state['centroids'] = self._centroids
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self._centroids = np.array(state['centroids'], dtype=self.dtype)
+        if self._use_kd_tree:
+            self._centroid_kd_tree = cKDTree(self._centroids,
+                                             **self._ckdtree_kwargs)
+
+
+class BbqSparseGrid(BBQArchiveBase):
+    """ Grid archive that only stores the bins that are filled.
+
+    Elites are kept in slots of compact arrays, which double in size when they
+    are full, and `_slots` maps the flat grid index of a bin to its slot. Bins
+    of a high resolution grid in many dimensions can outnumber the elites by
+    orders of magnitude, here memory and time grow with the number of elites.
+
+    Storage indices (`get_index`, `Elite.idx`, checkpoints) are slots, as if it
+    were a CVT archive with a centroid for each filled bin, `slot_bins` gives
+    the grid index of each slot.
+    """
+    # too many bins to draw, elites are plotted at their behaviors
+    plot_arrays = ("_occupied", "_objective_values", "_behavior_values")
+
+    def __init__(self, grid_res=None, desc_bounds=None, seed=None, use_objects=False,
+                 storage="ram", init_capacity=1024, **_):
+        self.use_objects = use_objects
+        if storage != "ram":
+            raise ValueError("Sparse grid archives are only stored in ram")
+        self._set_storage(storage)
+        self._dims = np.array(grid_res)
+        if len(self._dims) != len(desc_bounds):
+            raise ValueError(f"grid_res (length {len(self._dims)}) and desc_bounds "
+                             f"(length {len(desc_bounds)}) must be the same length")
+        n_bins = int(np.prod(self._dims, dtype=object))
+        if n_bins > np.iinfo(np.int64).max:
+            raise ValueError(f"{n_bins} bins cannot be indexed with int64")
+        super().__init__((init_capacity,), len(self._dims), seed)
+        self._bins = n_bins # all bins of the grid, not the slots
+
+        ranges = list(zip(*desc_bounds))
+        self._lower_bounds = np.array(ranges[0], dtype=self.dtype)
+        self._upper_bounds = np.array(ranges[1], dtype=self.dtype)
+        self._interval_size = self._upper_bounds - self._lower_bounds
+
+    @property
+    def dims(self):
+        """ Number of bins in each dimension of the grid """
+        return self._dims
+
+    @property
+    def slot_bins(self):
+        """ Flat grid index of the bin in each slot in use """
+        return self._slot_bins[:len(self._slots)]
+
+    def initialize(self, solution_dim):
+        super().initialize(solution_dim)
+        self._slots = {}
+        self._slot_bins = np.full(self._storage_dims, -1, dtype=np.int64)
+
+    def grid_index_batch(self, behavior_values):
+        """ Flat grid index of a batch of behaviors, same rule as BbqGrid """
+        behavior_values = np.minimum(
+            np.maximum(behavior_values + _EPSILON, self._lower_bounds),
+            self._upper_bounds - _EPSILON)
+        index = ((behavior_values - self._lower_bounds) / self._interval_size
+                 * self._dims).astype(np.int64)
+        return np.ravel_multi_index(tuple(index.T), self._dims)
+
+    def get_index_batch(self, behavior_values):
+        """ Slots of a batch of behaviors, bins not seen before get new ones """
+        slots = np.empty(len(behavior_values), dtype=int)
+        for i, key in enumerate(self.grid_index_batch(behavior_values).tolist()):
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._slots[key] = len(self._slots)
+                if slot == self._storage_dims[0]:
+                    self._resize(2 * slot)
+                self._slot_bins[slot] = key
+            slots[i] = slot
+        return (slots,)
+
+    def get_index(self, behavior_values):
+        return int(self.get_index_batch(np.asarray(behavior_values)[None])[0][0])
+
+    def elite_with_behavior(self, behavior_values):
+        key = int(self.grid_index_batch(np.asarray(behavior_values)[None])[0])
+        if key not in self._slots: # do not give empty bins a slot
+            return Elite(None, None, None, None, None)
+        return super().elite_with_behavior(behavior_values)
+
+    def _resize(self, capacity):
+        """ Moves storage into arrays with room for `capacity` elites """
+        n = min(capacity, self._storage_dims[0])
+        fills = {'_occupied': False, '_objective_values': np.nan,
+                 '_changed': False, '_slot_bins': -1}
+        for attr in ('_occupied', '_solutions', '_objective_values',
+                     '_behavior_values', '_metadata', '_changed', '_slot_bins'):
+            old = getattr(self, attr)
+            new = np.empty((capacity, *old.shape[1:]), dtype=old.dtype)
+            if attr in fills:
+                new[n:] = fills[attr]
+            new[:n] = old[:n]
+            setattr(self, attr, new)
+        self._storage_dims = (capacity,)
+
+    def get_state(self):
+        """ As BBQArchiveBase, plus the bin of each slot """
+        state = super().get_state()
+        state['slot_bins'] = self.slot_bins
+        return state
+
+    def set_state(self, state):
+        self._resize(len(state['occupied']))
+        super().set_state(state)
+        slot_bins = np.asarray(state['slot_bins'], dtype=np.int64)
+        self._slot_bins[:len(slot_bins)] = slot_bins
+        self._slots = {key: slot for slot, key in enumerate(slot_bins.tolist())}
+
 
-archive_lookup = {'Grid'    : BbqGrid,
-                  'CVT'     : BbqCVT}
+archive_lookup = {'Grid'      : BbqGrid,
+                  'CVT'       : BbqCVT,
+                  'SparseGrid': BbqSparseGrid}
 
-def init_archive(p):
-    """ Initializes archives from archive yaml config"""
+def init_archive(p, storage_dir=None):
+    """ Initializes archives from archive yaml config, memory mapped storage
+    goes into storage_dir (see BBQArchiveBase._set_storage)"""
     a_config = p['archive']
     archive_type = archive_lookup[a_config['type']]
-    archive = archive_type(**a_config)
+    archive = archive_type(**{'storage_dir': storage_dir, **a_config})
     return archive
 
 
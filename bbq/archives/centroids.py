@@ -0,0 +1,92 @@
+"""Centroids of CVT archives, cached on disk
+
+k-means over many samples takes a while for large archives, but the centroids
+only depend on the number of bins, the behavior bounds, the number of samples
+and the seed. They are generated once for each combination and saved as
+`.npy` files named by a hash of it, every later archive with the same
+settings loads them instead. Replicates without a seed share one tessellation.
+
+Fill the cache for a set of experiments before running them with:
+
+    python -m bbq.archives.centroids config/d_arm.yaml config/d_rast.yaml,config/x_cvt.yaml
+
+where each argument is a config file, or config files separated by commas
+that are combined as in a run.
+"""
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+from sklearn.cluster import k_means
+
+from bbq.utils import load_config
+
+CACHE_DIR = Path.home() / '.cache' / 'bbq' / 'centroids'
+
+
+def make_centroids(n_bins, desc_bounds, samples=100_000, seed=None):
+    """ k-means centroids of uniform samples, with the settings of pyribs """
+    lower, upper = np.array(desc_bounds, dtype=np.float64).T
+    rng = np.random.default_rng(seed)
+    points = rng.uniform(lower, upper, size=(samples, len(lower)))
+    centroids = k_means(points, n_bins, n_init=1, init="random",
+                        algorithm="lloyd", random_state=seed)[0]
+    if centroids.shape[0] < n_bins:
+        raise RuntimeError(
+            f"k-means found {centroids.shape[0]} centroids, but {n_bins} bins "
+            "are needed. There are too few samples and/or too many bins.")
+    return centroids
+
+
+def centroid_key(n_bins, desc_bounds, samples, seed):
+    """ Hash of everything the centroids depend on """
+    settings = {'n_bins': int(n_bins), 'samples': int(samples), 'seed': seed,
+                'desc_bounds': [[float(b) for b in bounds]
+                                for bounds in desc_bounds]}
+    blob = json.dumps(settings, sort_keys=True).encode()
+    return hashlib.sha1(blob).hexdigest()[:16]
+
+
+def cached_centroids(n_bins, desc_bounds, samples=100_000, seed=None,
+                     cache_dir=CACHE_DIR):
+    """ Centroids from the cache in `cache_dir`, generated and saved there
+    when they are not in it yet """
+    cache_dir = Path(cache_dir).expanduser()
+    path = cache_dir / (f'cvt_{n_bins}_{len(desc_bounds)}d_'
+                        f'{centroid_key(n_bins, desc_bounds, samples, seed)}.npy')
+    if path.exists():
+        centroids = np.load(path)
+        if centroids.shape == (n_bins, len(desc_bounds)):
+            return centroids
+
+    centroids = make_centroids(n_bins, desc_bounds, samples, seed)
+    # Runs in parallel may generate the same centroids, each writes its own
+    # file and moves it into place in one step
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'{path.stem}.{os.getpid()}.tmp.npy')
+    np.save(tmp, centroids)
+    os.replace(tmp, path)
+    return centroids
+
+
+def precompute_centroids(*configs, cache_dir=None):
+    """ Fills the cache for the CVT archives of the given configs """
+    for config in configs:
+        files = config.split(',') if isinstance(config, str) else list(config)
+        archive = load_config(files).get('archive', {})
+        if archive.get('type') != 'CVT' or archive.get('centroid_cache') is False:
+            continue
+        start = time.time()
+        cached_centroids(archive['n_bins'], archive['desc_bounds'],
+                         archive.get('samples', 100_000), archive.get('seed'),
+                         cache_dir or archive.get('centroid_cache') or CACHE_DIR)
+        print(f"{files}: {archive['n_bins']} centroids "
+              f"({time.time()-start:.1f}s)")
+
+
+if __name__ == '__main__':
+    fire.Fire(precompute_centroids)
@@ -0,0 +1 @@
+""" Timings of BBQ hot paths, run each module with `python -m` """
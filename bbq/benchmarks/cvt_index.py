@@ -0,0 +1,68 @@
+"""Compares nearest centroid searches of BbqCVT
+
+    python -m bbq.benchmarks.cvt_index
+    python -m bbq.benchmarks.cvt_index --n_bins="[1000,50000]" --dims="[2,10]"
+
+Times one batch query for each `centroid_index` backend, and the search one
+solution at a time that `add` used before, for every combination of archive
+size, behavior dimensions and batch size. Centroids are drawn uniformly
+instead of with k-means, which does not change the cost of the search.
+"""
+import fire
+import numpy as np
+from ribs.archives import CVTArchive
+
+from bbq.archives._init_archive import BbqCVT, cvt_index_lookup
+from bbq.benchmarks.timing import best_time
+
+
+def make_archive(centroids, centroid_index):
+    archive = BbqCVT(len(centroids), [[0, 1]] * centroids.shape[1],
+                     centroid_index=centroid_index, custom_centroids=centroids)
+    archive.initialize(1)
+    return archive
+
+
+def time_cvt_index(n_bins=(1000, 10000, 50000), dims=(2, 6, 10),
+                   batch=(100, 1000), repeats=5, max_brute_mb=1000, seed=0):
+    """ Seconds per batch for each backend, one dict per combination """
+    rng = np.random.default_rng(seed)
+    for n in n_bins:
+        for d in dims:
+            centroids = rng.random((n, d))
+            archives = {b: make_archive(centroids, b) for b in cvt_index_lookup}
+            for n_batch in batch:
+                behaviors = rng.random((n_batch, d))
+                row = {'n_bins': n, 'dims': d, 'batch': n_batch}
+                # ribs get_index, one solution at a time
+                serial = archives['brute']
+                row['serial'] = best_time(lambda: [
+                    CVTArchive.get_index(serial, b) for b in behaviors], repeats)
+                expected = None
+                for b, archive in archives.items():
+                    if b == 'brute' and n_batch * n * d * 8 / 1e6 > max_brute_mb:
+                        row[b] = np.nan # would not fit in memory
+                        continue
+                    row[b] = best_time(
+                        lambda: archive.get_index_batch(behaviors), repeats)
+                    index = archive.get_index_batch(behaviors)[0]
+                    if expected is None:
+                        expected = index
+                    elif not np.array_equal(index, expected):
+                        print(f"  {b} disagrees on "
+                              f"{np.sum(index != expected)} behaviors")
+                yield row
+
+
+def bench_cvt_index(**kwargs):
+    """ Prints milliseconds per batch, options as in time_cvt_index """
+    columns = ['serial'] + list(cvt_index_lookup)
+    print(f"{'n_bins':>7} {'dims':>4} {'batch':>6} |" +
+          "".join(f"{c:>10}" for c in columns) + "  (ms)")
+    for row in time_cvt_index(**kwargs):
+        print(f"{row['n_bins']:>7} {row['dims']:>4} {row['batch']:>6} |" +
+              "".join(f"{1e3*row[c]:>10.2f}" for c in columns))
+
+
+if __name__ == '__main__':
+    fire.Fire(bench_cvt_index)
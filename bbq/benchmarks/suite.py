@@ -0,0 +1,288 @@
+"""Benchmark suite of BBQ hot paths, with regression checks
+
+    python -m bbq.benchmarks.suite run                      # all, compare to baseline
+    python -m bbq.benchmarks.suite run --only=archive,cma --out=bench.json
+    python -m bbq.benchmarks.suite run --save_baseline      # new baseline
+    python -m bbq.benchmarks.suite compare bench.json --threshold=1
+
+Each benchmark times one hot path in isolation, over archive sizes, behavior
+dimensions, genome sizes and batch sizes:
+
+    archive   - add_batch into a filled Grid, CVT or SparseGrid archive
+    emitter   - ask and tell of each emitter type, with a cheap objective
+    cma       - ask and tell of full and separable CMA-ES alone
+    logging   - RibsLogger.log_metrics per generation, with and without saving
+    evaluator - evaluating a batch of Rastrigin on each evaluator backend,
+                mostly the cost of dispatching it
+
+Results are written as JSON, one entry per case with its parameters and the
+seconds per call (the fastest of several rounds). A case is flagged as a
+regression when it is more than `threshold` slower than in the baseline.
+Timings depend on the machine: the stored `baseline.json` is only a useful
+reference on the machine it was made on, save a new one before comparing
+elsewhere.
+"""
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+from ribs.optimizers import Optimizer
+
+from bbq.archives._init_archive import archive_lookup
+from bbq.benchmarks.timing import best_time
+from bbq.domains._evaluators import init_evaluator
+from bbq.emitters._cma_es import cma_lookup
+from bbq.emitters._init_emitter import init_emitter
+from bbq.examples.rastrigin import Rastrigin
+from bbq.logging.logger import RibsLogger
+
+BASELINE = Path(__file__).parent / 'baseline.json'
+
+
+# - Helpers -------------------------------------------------------------------#
+def make_archive(kind, dims, solution_dim=None, seed=0, **kwargs):
+    """ Archive with random centroids for CVTs (no k-means), initialized if
+    given a solution_dim """
+    rng = np.random.default_rng(seed)
+    bounds = [[0, 1]] * dims
+    if kind == 'CVT':
+        kwargs['custom_centroids'] = rng.random((kwargs['n_bins'], dims))
+    archive = archive_lookup[kind](desc_bounds=bounds, **kwargs)
+    if solution_dim is not None:
+        archive.initialize(solution_dim)
+    return archive
+
+
+def random_batch(rng, n, solution_dim, dims):
+    return (rng.random((n, solution_dim)), rng.random(n), rng.random((n, dims)))
+
+
+def sphere(xx):
+    """ Cheap objective and behaviors for emitter benchmarks """
+    xx = np.asarray(xx)
+    return -np.sum((xx - 0.5)**2, axis=1), np.clip(xx[:, :2], 0, 1)
+
+
+def time_ask_tell(ask, tell, repeats, number):
+    """ Fastest seconds per ask and per tell, evaluation is not timed """
+    best_ask, best_tell = np.inf, np.inf
+    for _ in range(repeats):
+        t_ask = t_tell = 0.0
+        for _ in range(number):
+            start = time.perf_counter()
+            sols = ask()
+            t_ask += time.perf_counter() - start
+            objs, descs = sphere(sols)
+            start = time.perf_counter()
+            tell(sols, objs, descs)
+            t_tell += time.perf_counter() - start
+        best_ask = min(best_ask, t_ask / number)
+        best_tell = min(best_tell, t_tell / number)
+    return best_ask, best_tell
+
+
+# - Benchmarks ----------------------------------------------------------------#
+def bench_archive(repeats=5):
+    """ add_batch into an archive already holding 20k insertions """
+    archives = [('Grid', 2, {'grid_res': [50, 50]}),
+                ('Grid', 2, {'grid_res': [500, 500]}),
+                ('CVT', 2, {'n_bins': 1000}),
+                ('CVT', 6, {'n_bins': 10000}),
+                ('SparseGrid', 6, {'grid_res': [100]*6})]
+    for kind, dims, kwargs in archives:
+        for batch in (64, 1024):
+            rng = np.random.default_rng(0)
+            archive = make_archive(kind, dims, 10, **kwargs)
+            archive.add_batch(*random_batch(rng, 20000, 10, dims))
+            batches = [random_batch(rng, batch, 10, dims) for _ in range(20)]
+            it = iter(batches * repeats * 20)
+            seconds = best_time(lambda: archive.add_batch(*next(it)),
+                                repeats, number=20)
+            size = kwargs.get('n_bins') or 'x'.join(map(str, kwargs['grid_res']))
+            yield {'archive': kind, 'dims': dims, 'size': size,
+                   'batch': batch}, seconds
+
+
+def bench_emitter(repeats=5):
+    """ ask and tell of each emitter on a 50x50 grid """
+    emitters = {'Gauss': {'type': 'Gauss', 'sigma0': 0.05},
+                'Line': {'type': 'Line', 'iso_sigma': 0.01, 'line_sigma': 0.2},
+                'Cma': {'type': 'Cma', 'sigma0': 0.05},
+                'Cma-sep': {'type': 'Cma', 'sigma0': 0.05, 'cma_type': 'sep'}}
+    for name, config in emitters.items():
+        for n_dof in (10, 100):
+            rng = np.random.default_rng(0)
+            archive = make_archive('Grid', 2, n_dof, grid_res=[50, 50])
+            start_xx = rng.random((500, n_dof))
+            archive.add_batch(start_xx, *sphere(start_xx))
+            p = {'n_dof': n_dof, 'param_bounds': [0, 1],
+                 'emitters': [{**config, 'batch_size': 64, 'seed': 0}]}
+            np.random.seed(0)
+            emitter = init_emitter(p, archive, start_xx)[0]
+            t_ask, t_tell = time_ask_tell(
+                emitter.ask, emitter.tell, repeats, number=10)
+            params = {'emitter': name, 'n_dof': n_dof, 'batch': 64}
+            yield {**params, 'phase': 'ask'}, t_ask
+            yield {**params, 'phase': 'tell'}, t_tell
+
+
+def bench_cma(repeats=5):
+    """ CMA-ES ask and tell without an archive """
+    for cma_type in cma_lookup:
+        for n in (10, 100, 1000):
+            opt = cma_lookup[cma_type](0.05, None, n, "truncation", 0,
+                                       np.float64)
+            opt.reset(np.full(n, 0.5))
+            lower, upper = np.zeros(n), np.ones(n)
+            t_ask, t_tell = time_ask_tell(
+                lambda: opt.ask(lower, upper),
+                lambda sols, objs, _: opt.tell(sols[np.argsort(-objs)],
+                                               opt.batch_size // 2),
+                repeats, number=10)
+            params = {'cma_type': cma_type, 'n': n}
+            yield {**params, 'phase': 'ask'}, t_ask
+            yield {**params, 'phase': 'tell'}, t_tell
+
+
+def bench_logging(repeats=5):
+    """ RibsLogger.log_metrics per generation of a Gauss emitter, metrics
+    only or also checkpointing the changed bins every generation """
+    for save_rate in (10**9, 1):
+        with tempfile.TemporaryDirectory() as root:
+            rng = np.random.default_rng(0)
+            archive = make_archive('Grid', 2, grid_res=[100, 100])
+            start_xx = rng.random((500, 10))
+            p = {'task_name': 'bench', 'exp_name': 'logging', 'n_dof': 10,
+                 'param_bounds': [0, 1], 'print_rate': 10**9,
+                 'plot_rate': 10**9, 'save_rate': save_rate,
+                 'emitters': [{'type': 'Gauss', 'sigma0': 0.05,
+                               'batch_size': 64}]}
+            opt = Optimizer(archive, init_emitter(p, archive, start_xx))
+            archive.add_batch(start_xx, *sphere(start_xx))
+            logger = RibsLogger(p, copy_config=False, root_path=root)
+            times = []
+            for itr in range(1, 20 * repeats + 1):
+                sols = opt.ask()
+                objs, descs = sphere(sols)
+                opt.tell(objs, descs)
+                start = time.perf_counter()
+                logger.log_metrics(opt, None, itr, 0.0)
+                times.append(time.perf_counter() - start)
+            logger.metrics.close()
+            # fastest round of 20 generations
+            seconds = min(np.mean(times[i:i+20])
+                          for i in range(0, len(times), 20))
+            yield {'save': save_rate == 1}, seconds
+
+
+def bench_evaluator(repeats=5):
+    """ Evaluating 256 cheap individuals on two workers, per batch """
+    domain = Rastrigin(n_dof=10)
+    xx = np.random.default_rng(0).random((256, 10))
+    for evaluator in ('serial', 'threads', 'processes', 'dask'):
+        for eval_chunk in (1, 32):
+            ev = init_evaluator(domain, evaluator, n_workers=2,
+                                eval_chunk=eval_chunk)
+            ev.eval(xx) # workers started and warm
+            seconds = best_time(lambda: ev.eval(xx), repeats, number=3)
+            ev.close()
+            yield {'evaluator': evaluator, 'eval_chunk': eval_chunk}, seconds
+
+
+benchmark_lookup = {'archive'  : bench_archive,
+                    'emitter'  : bench_emitter,
+                    'cma'      : bench_cma,
+                    'logging'  : bench_logging,
+                    'evaluator': bench_evaluator}
+
+
+# - Running and comparing -----------------------------------------------------#
+def case_key(bench, params):
+    """ Unique name of a case, e.g. 'cma[cma_type=sep,n=100,phase=ask]' """
+    return f"{bench}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+
+def run_suite(only=None, repeats=5):
+    """ Runs the benchmarks named in `only` (all if None), returns results in
+    the format of the JSON files """
+    names = list(benchmark_lookup) if only is None else only
+    results = []
+    for name in names:
+        for params, seconds in benchmark_lookup[name](repeats):
+            key = case_key(name, params)
+            print(f"{key:<68} {1e3*seconds:10.3f} ms")
+            results.append({'key': key, 'bench': name, 'params': params,
+                            'seconds': seconds})
+    meta = {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'machine': platform.node(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'python': platform.python_version(),
+            'numpy': np.__version__}
+    return {'meta': meta, 'results': results}
+
+
+def compare_results(results, baseline, threshold=0.5):
+    """ Cases at least `threshold` (a fraction) slower than in the baseline,
+    as (key, baseline seconds, seconds) """
+    base = {r['key']: r['seconds'] for r in baseline['results']}
+    return [(r['key'], base[r['key']], r['seconds'])
+            for r in results['results']
+            if r['key'] in base and r['seconds'] > (1 + threshold) * base[r['key']]]
+
+
+def report(results, baseline, threshold):
+    """ Prints a comparison with the baseline, returns the regressions """
+    if baseline['meta'].get('machine') != results['meta'].get('machine'):
+        print(f"[!] Baseline is from {baseline['meta'].get('machine')}, "
+              "timings of different machines are not comparable")
+    regressions = compare_results(results, baseline, threshold)
+    base = {r['key']: r['seconds'] for r in baseline['results']}
+    print(f"\n{'case':<68} {'baseline':>10} {'now':>10} {'ratio':>7}")
+    for r in results['results']:
+        if r['key'] not in base:
+            continue
+        ratio = r['seconds'] / base[r['key']]
+        flag = '  <-- slower' if ratio > 1 + threshold else ''
+        print(f"{r['key']:<68} {1e3*base[r['key']]:10.3f} "
+              f"{1e3*r['seconds']:10.3f} {ratio:7.2f}{flag}")
+    print(f"\n{len(regressions)} regression(s) beyond {threshold:.0%}")
+    return regressions
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def run(only=None, repeats=5, out='bench_results.json', baseline=BASELINE,
+        threshold=0.5, save_baseline=False):
+    """ Runs the suite, writes results to `out` and compares them with the
+    baseline. Exits with status 1 if any case regressed. """
+    if isinstance(only, str):
+        only = only.split(',')
+    results = run_suite(only, repeats)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=1)
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        print(f"Saved baseline to {baseline}")
+    elif Path(baseline).exists():
+        if report(results, load_results(baseline), threshold):
+            sys.exit(1)
+
+
+def compare(results, baseline=BASELINE, threshold=0.5):
+    """ Compares a results file with the baseline, exits with status 1 if
+    any case regressed """
+    if report(load_results(results), load_results(baseline), threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    fire.Fire({'run': run, 'compare': compare})
@@ -0,0 +1,15 @@
+""" Timer shared by the benchmarks """
+import time
+
+
+def best_time(f, repeats=5, number=1):
+    """ Seconds per call of `f`, the fastest of `repeats` rounds of `number`
+    calls. The fastest round is the one least disturbed by the rest of the
+    machine. """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        times.append((time.perf_counter() - start) / number)
+    return min(times)
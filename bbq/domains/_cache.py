@@ -0,0 +1,203 @@
+""" Cache of evaluation results, to skip evaluating the same genome twice
+
+Emitters regularly propose genomes that were already evaluated, e.g. CMA-ES
+samples clipped onto the same bound, or children of tiny mutations. With
+`eval_cache: True` in the config every genome is looked up by a hash of its
+bytes first and only the ones not seen before are evaluated, genomes repeated
+within a batch are evaluated once. `BbqDomain.batch_eval` does this for
+blocking evaluations, `SubmittedBatch` for batches submitted to the evaluator
+(the steady state loop and the initial chunks evaluated alongside the search),
+whose results are cached once they are collected.
+
+    eval_cache_mb      - memory budget, least recently used results are dropped
+                         beyond it (default 256)
+    eval_cache_quantum - genomes are rounded to multiples of this before
+                         hashing, so near-identical genomes share one result
+                         (default None: exact bytes)
+    eval_cache_file    - results are loaded from this file at the start of a
+                         run and saved to it at the end, to share them between
+                         replicates (default None)
+
+Only use a cache for deterministic domains, and a cache file only with one
+domain setup: the keys do not include the settings of the domain.
+"""
+import hashlib
+import os
+import pickle
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+ENTRY_BYTES = 200 # key, tuple and dict slot of an entry, roughly
+
+
+class EvalCache():
+    """ LRU cache of (obj, desc, meta) per genome, within `max_mb` MB """
+    def __init__(self, max_mb=256, quantum=None, path=None, genome=None):
+        self.max_bytes = int(max_mb * 2**20)
+        self.quantum = quantum
+        self.path = None if path is None else Path(path)
+        self.genome = genome or (lambda x: x) # array a key is made from
+        self.entries = OrderedDict() # key -> (obj, desc, meta), oldest first
+        self.n_bytes = 0
+        self.hits = self.misses = 0
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def key(self, x):
+        """ Hash of the (quantized) bytes of the genome of x """
+        x = np.asarray(self.genome(x))
+        if x.dtype == object:
+            raise TypeError("Cannot hash object genomes, return an array of "
+                            "their values from the domain's cache_genome")
+        if self.quantum:
+            x = np.round(x / self.quantum).astype(np.int64)
+        return hashlib.blake2b(np.ascontiguousarray(x).tobytes(),
+                               digest_size=16).digest()
+
+    def batch_eval(self, xx, evaluate):
+        """ Results of the individuals in xx, calling `evaluate` on those
+        not in the cache. Returns objs, descs, metas like batch_eval. """
+        keys, results, index = self.lookup(xx)
+        if index:
+            objs, descs, metas = evaluate(take(xx, index))
+            results = self.store(keys, results, index,
+                                 list(zip(objs, descs, metas)))
+        return stack(results)
+
+    def lookup(self, xx):
+        """ Keys of the individuals in xx, their cached (obj, desc, meta)
+        (None if not cached) and the index of the first individual of every
+        key that is not, which are the ones to evaluate """
+        keys = [self.key(x) for x in xx]
+        results = [None] * len(keys)
+        new = {} # key -> first index of individuals to evaluate
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                results[i] = self.entries[key]
+            elif key not in new:
+                new[key] = i
+        self.misses += len(new)
+        self.hits += len(keys) - len(new)
+        return keys, results, list(new.values())
+
+    def store(self, keys, results, index, new_results):
+        """ Caches the results of the individuals at `index` (from `lookup`)
+        and fills them into `results`, repeats in the batch get the result of
+        the first """
+        fresh = {}
+        for i, (obj, desc, meta) in zip(index, new_results):
+            self.put(keys[i], (obj, copy_array(desc), copy_array(meta)))
+            fresh[keys[i]] = (obj, desc, meta)
+        return [fresh[key] if result is None else result
+                for key, result in zip(keys, results)]
+
+    def put(self, key, result):
+        """ Adds a result, dropping the least recently used beyond the budget """
+        self.entries[key] = result
+        self.n_bytes += result_bytes(result)
+        while self.n_bytes > self.max_bytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.n_bytes -= result_bytes(old)
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries), 'mb': self.n_bytes / 2**20}
+
+    def save(self):
+        """ Writes the cache to `path`, replacing the file in one step as
+        replicates running at the same time may save to it too """
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with tmp.open('wb') as file:
+            pickle.dump({'quantum': self.quantum,
+                         'entries': list(self.entries.items())}, file)
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """ Adds the results saved in `path`, unless saved with another
+        quantum (their keys would not match) """
+        with self.path.open('rb') as file:
+            saved = pickle.load(file)
+        if saved['quantum'] != self.quantum:
+            print(f"[!] Ignoring {self.path}, saved with quantum "
+                  f"{saved['quantum']} instead of {self.quantum}")
+            return
+        for key, result in saved['entries']:
+            self.put(key, result)
+        print(f"[*] Loaded {len(self.entries)} cached evaluations")
+
+
+class SubmittedBatch():
+    """ Individuals submitted to the evaluator through the domain's cache
+
+    Results of genomes in the cache are filled in right away and only the
+    others are submitted (`futures`, as (future, slice) pairs over them).
+    Results of finished futures are handed back with `set`, once all are in
+    (`done`) `collect` caches them and returns the results of the batch.
+    Genomes in two batches in flight at once are evaluated for each.
+    """
+    def __init__(self, d, xx, evaluator):
+        self.cache = d.cache
+        if self.cache is None:
+            self.keys, self.results, self.index = None, None, range(len(xx))
+            new_xx = xx
+        else:
+            self.keys, self.results, self.index = self.cache.lookup(xx)
+            new_xx = take(xx, self.index)
+        self.new_results = [None] * len(self.index)
+        self.left = len(self.index)
+        self.futures = d.batch_submit(new_xx, evaluator) if self.left else []
+
+    @property
+    def done(self):
+        return self.left == 0
+
+    def set(self, part, results):
+        """ Results of the submitted individuals in slice `part` """
+        self.new_results[part] = results
+        self.left -= len(results)
+
+    def collect(self):
+        """ objs, descs, metas of the whole batch """
+        if self.cache is None:
+            return stack(self.new_results)
+        return stack(self.cache.store(self.keys, self.results, self.index,
+                                      self.new_results))
+
+
+def take(xx, index):
+    """ Individuals at `index`, of an array or a list of objects """
+    return xx[index] if isinstance(xx, np.ndarray) else [xx[i] for i in index]
+
+
+def stack(results):
+    """ objs, descs, metas of a list of (obj, desc, meta) """
+    objs, descs, metas = zip(*results)
+    return np.asarray(objs), np.vstack(descs), list(metas)
+
+
+def copy_array(value):
+    """ Arrays are copied so cached rows do not keep whole batches alive """
+    return value.copy() if isinstance(value, np.ndarray) else value
+
+
+def result_bytes(result):
+    return ENTRY_BYTES + sum(v.nbytes if isinstance(v, np.ndarray)
+                             else sys.getsizeof(v) for v in result)
+
+
+def init_cache(p, domain):
+    """ Evaluation cache of the config, None without `eval_cache` """
+    if not p.get('eval_cache', False):
+        return None
+    return EvalCache(p.get('eval_cache_mb', 256), p.get('eval_cache_quantum'),
+                     p.get('eval_cache_file'), genome=domain.cache_genome)
@@ -1,9 +1,18 @@
+import inspect
 import numpy as np
-from bbq.domains._parallel import create_dask_client, dask_eval
+from bbq.domains._evaluators import init_evaluator
+from bbq.logging.timing import NULL_TIMER
 
 
 # - Base Domains --------------------------------------------------------------#
 class BbqDomain():
+    # Own steps to time when `time_phases` is set, e.g. ('simulate',). Report
+    # them in the main process with
+    #     start = self.timer.start(); ...; self.timer.stop('simulate', start)
+    timed_phases = ()
+    timer = NULL_TIMER # set by map_elites
+    cache = None       # EvalCache set by map_elites with `eval_cache`
+
     #def __init__(self, n_params=1, n_workers=1, **_):
     def __init__(self, n_dof=1, n_workers=1, **_):
         self.n_dof = n_dof
@@ -24,6 +33,22 @@ class BbqDomain():
         desc = self._desc(pheno)
         return obj, desc, pheno
 
+    def evaluate_batch(self, xx):
+        """ Evaluates a whole batch of individuals at once
+
+        By default `evaluate` is called on each individual. Domains whose 
+        expression, fitness and descriptor work on a 2D array of individuals 
+        should override this to evaluate at numpy speed.
+
+        Args:
+            xx ([NxM numpy array]): Raw parameter values between 0 and 1
+
+        Returns:
+            objs, descs, metas: objectives [N], descriptors [N x D], metadata [N]
+        """
+        objs, descs, metas = zip(*[self.evaluate(x) for x in xx])
+        return np.asarray(objs), np.asarray(descs), metas
+
     def express(self, xx):
         """ This function turns the raw parameter values that the optimization
         algorithm works on (the genotype) into something that can be properly
@@ -48,31 +73,67 @@ class BbqDomain():
         Returns:
             [NxM np_array]: Initial solutions
         """
-        initial_solutions = np.random.rand(n_solutions, self.n_params)
+        initial_solutions = np.random.rand(n_solutions, self.n_dof)
         return initial_solutions        
 
-    def prep_eval(self, n_workers=1, **kwargs):
+    def init_chunks(self, n_solutions, chunk_size=None):
+        """Initial solutions in chunks of at most `chunk_size` (all at once if
+        None), which are evaluated and added to the archive as they come.
+
+        `init` can also be a generator of chunks, for initial solutions that
+        are too many or too large to make or load all at once. Its chunks are
+        used as they are.
+        """
+        solutions = self.init(n_solutions)
+        if inspect.isgenerator(solutions):
+            yield from solutions
+            return
+        chunk_size = chunk_size or len(solutions)
+        for i in range(0, len(solutions), chunk_size):
+            yield solutions[i:i+chunk_size]
+
+    def prep_eval(self, n_workers=1, eval_chunk=1, evaluator=None, **kwargs):
         """ Prepare evaluation if necessary: 
-            - start up dask clients
+            - start up the evaluator backend (serial, threads, processes, dask)
             - set up file structures for external evaluators
             - or nothing, the results here will be used by batch eval
-        """
-        if n_workers == 1:
-            client = None
-        else:
-            print(f"[*] Starting dask client with {n_workers} workers", end='...')
-            client = create_dask_client(n_workers)
-            print(f"done.")
 
-        return client
+        Worker processes get their copy of the domain once here, later 
+        changes to the domain object are not seen by them. Each task
+        evaluates `eval_chunk` individuals.
+        """
+        return init_evaluator(self, evaluator, n_workers, eval_chunk)
 
     def batch_eval(self, xx, evaluator=None):
+        """ Evaluates a batch with the evaluator, or in this process without
+        one. With an evaluation cache only genomes not seen before are
+        evaluated. """
+        if self.cache is not None:
+            return self.cache.batch_eval(
+                xx, lambda new_xx: self.eval_uncached(new_xx, evaluator))
+        return self.eval_uncached(xx, evaluator)
+
+    def eval_uncached(self, xx, evaluator=None):
         if evaluator == None:
-            objs, descs, metas = zip(*[self.evaluate(x) for x in xx])
+            start = self.timer.start()
+            objs, descs, metas = self.evaluate_batch(xx)
+            self.timer.stop('eval-wait', start)
         else:
-            objs, descs, metas = dask_eval(xx, self.evaluate, evaluator) 
+            objs, descs, metas = evaluator.eval(xx, self.timer)
         return objs, descs, metas       
 
+    def cache_genome(self, x):
+        """ Array of values the evaluation cache hashes an individual by,
+        domains with object genomes return the values that define them """
+        return x
+
+    def batch_submit(self, xx, evaluator):
+        """ Starts evaluating the individuals without waiting, returns 
+        (future, slice) pairs, each future resolving to a list of
+        (obj, desc, meta) for the individuals xx[slice]
+        """
+        return evaluator.submit(xx)
+
 
 def is_class(o):
     return hasattr(o, '__dict__')
\ No newline at end of file
@@ -0,0 +1,184 @@
+""" Evaluation backends, selected with `evaluator` in the yaml config.
+
+All backends share one interface used by `BbqDomain.batch_eval` and the
+MAP-Elites loops:
+    - eval(xx, timer) -> objs, descs, metas of a whole batch (blocking),
+                    timing its 'eval-submit' and 'eval-wait' phases
+    - submit(xx) -> (future, slice) pairs, each future resolving to a list of
+                    (obj, desc, meta) for the individuals xx[slice]
+    - stream()   -> iterator over submitted futures in the order they finish,
+                    more futures can be added to it while iterating
+    - close()    -> shuts down workers
+    - parallel   -> whether submitted individuals are evaluated in the
+                    background, the serial backend evaluates them on submit
+"""
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import numpy as np
+from bbq.domains._parallel import (chunk_slices, create_dask_client,
+                                   dask_stream, dask_submit, evaluate_chunk,
+                                   scatter_domain)
+from bbq.logging.timing import NULL_TIMER
+
+
+def collect(results):
+    """ Stacks lists of (obj, desc, meta) into objs, descs, metas """
+    objs, descs, metas = zip(*[r for chunk in results for r in chunk])
+    return np.hstack(objs), np.vstack(descs), list(metas)
+
+
+class FutureStream():
+    """ concurrent.futures in the order they finish, more can be added """
+    def __init__(self):
+        self._pending = set()
+        self._done = deque()
+
+    def add(self, future):
+        self._pending.add(future)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._done:
+            if not self._pending:
+                raise StopIteration
+            done, self._pending = wait(self._pending,
+                                       return_when=FIRST_COMPLETED)
+            self._done.extend(done)
+        return self._done.popleft()
+
+
+# - Backends ------------------------------------------------------------------#
+class SerialEvaluator():
+    """ Evaluates in the main process, submitted futures are already done """
+    parallel = False
+
+    def __init__(self, domain, eval_chunk=1, **_):
+        self.domain = domain
+        self.eval_chunk = eval_chunk
+
+    def eval(self, xx, timer=NULL_TIMER):
+        start = timer.start()
+        results = self.domain.evaluate_batch(xx)
+        timer.stop('eval-wait', start)
+        return results
+
+    def submit(self, xx):
+        futures = []
+        for part in chunk_slices(len(xx), self.eval_chunk):
+            future = Future()
+            try:
+                objs, descs, metas = self.domain.evaluate_batch(xx[part])
+                future.set_result(list(zip(objs, descs, metas)))
+            except Exception as e:
+                future.set_exception(e)
+            futures += [(future, part)]
+        return futures
+
+    def stream(self):
+        return FutureStream()
+
+    def close(self):
+        pass
+
+
+class ThreadEvaluator(SerialEvaluator):
+    """ Pool of threads sharing the domain, for evaluations that release the
+    GIL (numpy, external simulators, I/O) """
+    parallel = True
+
+    def __init__(self, domain, n_workers=1, eval_chunk=1, **_):
+        super().__init__(domain, eval_chunk)
+        print(f"[*] Starting {n_workers} thread workers")
+        self.pool = ThreadPoolExecutor(n_workers)
+
+    def eval(self, xx, timer=NULL_TIMER):
+        start = timer.start()
+        futures = self.submit(xx)
+        start = timer.stop('eval-submit', start)
+        results = [f.result() for f, _ in futures]
+        timer.stop('eval-wait', start)
+        return collect(results)
+
+    def submit(self, xx):
+        return [(self.pool.submit(evaluate_chunk, self.domain, xx[part]), part)
+                for part in chunk_slices(len(xx), self.eval_chunk)]
+
+    def close(self):
+        self.pool.shutdown()
+
+
+class ProcessEvaluator(ThreadEvaluator):
+    """ Pool of persistent worker processes, each gets a copy of the domain
+    once when it starts """
+    def __init__(self, domain, n_workers=1, eval_chunk=1, **_):
+        self.domain = domain
+        self.eval_chunk = eval_chunk
+        print(f"[*] Starting {n_workers} process workers")
+        self.pool = ProcessPoolExecutor(n_workers, initializer=init_worker,
+                                        initargs=(domain,))
+
+    def submit(self, xx):
+        return [(self.pool.submit(evaluate_on_worker, xx[part]), part)
+                for part in chunk_slices(len(xx), self.eval_chunk)]
+
+
+class DaskEvaluator():
+    """ Local dask cluster, the domain is scattered to every worker once """
+    parallel = True
+
+    def __init__(self, domain, n_workers=1, eval_chunk=1, **_):
+        self.eval_chunk = eval_chunk
+        print(f"[*] Starting dask client with {n_workers} workers", end='...')
+        self.client = create_dask_client(n_workers)
+        self.remote = scatter_domain(domain, self.client)
+        print(f"done.")
+
+    def eval(self, xx, timer=NULL_TIMER):
+        start = timer.start()
+        futures = self.submit(xx)
+        start = timer.stop('eval-submit', start)
+        results = self.client.gather([f for f, _ in futures])
+        timer.stop('eval-wait', start)
+        return collect(results)
+
+    def submit(self, xx):
+        return dask_submit(xx, self.remote, self.client, self.eval_chunk)
+
+    def stream(self):
+        return dask_stream()
+
+    def close(self):
+        cluster = self.client.cluster
+        self.client.close()
+        if cluster is not None:
+            cluster.close()
+
+
+# - Worker side ---------------------------------------------------------------#
+_worker_domain = None
+
+def init_worker(domain):
+    """ Stores the domain in a worker process when it starts """
+    global _worker_domain
+    _worker_domain = domain
+
+def evaluate_on_worker(xx):
+    return evaluate_chunk(_worker_domain, xx)
+
+
+evaluator_lookup = {'serial'    : SerialEvaluator,
+                    'threads'   : ThreadEvaluator,
+                    'processes' : ProcessEvaluator,
+                    'dask'      : DaskEvaluator}
+
+def init_evaluator(domain, evaluator=None, n_workers=1, eval_chunk=1, **_):
+    """ Starts the evaluation backend named in the config, by default serial
+    with one worker and dask otherwise """
+    if evaluator is None:
+        evaluator = 'serial' if n_workers == 1 else 'dask'
+    evaluator_type = evaluator_lookup[evaluator]
+    return evaluator_type(domain, n_workers=n_workers, eval_chunk=eval_chunk)
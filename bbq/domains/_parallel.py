@@ -1,17 +1,32 @@
-from dask.distributed import Client, LocalCluster
-import numpy as np
+from dask.distributed import Client, LocalCluster, as_completed
 
-def dask_eval(xx, eval_func, client):
-    ''' Performs parallel evaluation across dask workers''' 
-    objs, descs, phenos = [], [], []           
-    futures = client.map(lambda x: eval_func(x), xx)
-    results = client.gather(futures)
-    for obj, desc, pheno in results:
-        objs.append(obj)
-        descs.append(desc)
-        phenos.append(pheno)
+def dask_submit(xx, domain, client, chunk_size=1):
+    ''' Submits individuals for evaluation without waiting for the results
 
-    return np.hstack(objs), np.vstack(descs), phenos
+    Returns (future, slice) pairs, each future resolving to the list of 
+    (obj, desc, meta) results of the individuals xx[slice].
+    '''
+    parts = chunk_slices(len(xx), chunk_size)
+    # pure=False: identical genomes still get their own task and result
+    return [(client.submit(evaluate_chunk, domain, xx[part], pure=False), part)
+            for part in parts]
+
+def chunk_slices(n, chunk_size):
+    ''' Slices splitting n individuals into chunks of chunk_size'''
+    return [slice(i, min(i+chunk_size, n)) for i in range(0, n, chunk_size)]
+
+def evaluate_chunk(domain, xx):
+    ''' Runs on the worker, with the worker's own copy of the domain'''
+    objs, descs, metas = domain.evaluate_batch(xx)
+    return list(zip(objs, descs, metas))
+
+def scatter_domain(domain, client):
+    ''' Sends domain to every worker once, tasks then only carry a reference'''
+    return client.scatter(domain, broadcast=True, hash=False)
+
+def dask_stream(futures=()):
+    ''' Iterator over futures in the order they finish, more can be added'''
+    return as_completed(futures)
 
 def create_dask_client(n_workers):
     ''' Creats local cluster of dask workers'''            
@@ -20,4 +35,4 @@ def create_dask_client(n_workers):
     n_workers=n_workers,  # Create this many worker processes.
     threads_per_worker=1,  # Each worker process is single-threaded.
     )
-    return Client(cluster)    
\ No newline at end of file
+    return Client(cluster)    
@@ -92,10 +92,16 @@ class CMAEvolutionStrategy:
             (positive weights only) or "active" (include negative weights).
         seed (int): Seed for the random number generator.
         dtype (str or data-type): Data type of solutions.
+        bound_handling (str): How out of bounds solutions are fixed in ask().
+            One of "resample" (sample until in bounds), "reflect", "clip",
+            "wrap" (periodic bounds) or "resample_reflect" (resample up to
+            ``bound_attempts`` times, then reflect what is still outside).
+        bound_attempts (int): Number of resampling rounds before reflecting
+            with "resample_reflect".
     """
 
     def __init__(self, sigma0, batch_size, solution_dim, weight_rule, seed,
-                 dtype):
+                 dtype, bound_handling="resample_reflect", bound_attempts=10):
         self.batch_size = (4 + int(3 * np.log(solution_dim))
                            if batch_size is None else batch_size)
         self.sigma0 = sigma0
@@ -106,6 +112,13 @@ class CMAEvolutionStrategy:
             raise ValueError(f"Invalid weight_rule {weight_rule}")
         self.weight_rule = weight_rule
 
+        if bound_handling not in bound_repairs:
+            raise ValueError(f"Invalid bound_handling {bound_handling}")
+        self.bound_handling = bound_handling
+        self.bound_attempts = {"resample": np.inf,
+                               "resample_reflect": bound_attempts
+                               }.get(bound_handling, 0)
+
         # Calculate gap between covariance matrix updates.
         num_parents = self.batch_size // 2
         *_, c1, cmu = self._calc_strat_params(self.solution_dim, num_parents,
@@ -138,7 +151,32 @@ class CMAEvolutionStrategy:
         self.ps = np.zeros(self.solution_dim, dtype=self.dtype)
 
         # Setup the covariance matrix.
-        self.cov = DecompMatrix(self.solution_dim, self.dtype)
+        self.cov = self._init_cov()
+
+    def _init_cov(self):
+        """Creates the covariance matrix, full rank with its eigensystem."""
+        return DecompMatrix(self.solution_dim, self.dtype)
+
+    def get_state(self):
+        """Distribution, evolution paths and random number generator state.
+
+        Arrays are not copied.
+        """
+        return {'current_eval': self.current_eval, 'mean': self.mean,
+                'sigma': self.sigma, 'pc': self.pc, 'ps': self.ps,
+                'cov': {k: v for k, v in vars(self.cov).items()
+                        if k != 'dtype'},
+                'rng': self._rng.bit_generator.state}
+
+    def set_state(self, state):
+        """Restores a state from :meth:`get_state`."""
+        self.reset(state['mean'])
+        self.current_eval = state['current_eval']
+        self.sigma = state['sigma']
+        self.pc, self.ps = state['pc'], state['ps']
+        for k, v in state['cov'].items():
+            setattr(self.cov, k, v)
+        self._rng.bit_generator.state = state['rng']
 
     def check_stop(self, ranking_values):
         """Checks if the optimization should stop and be reset.
@@ -156,7 +194,7 @@ class CMAEvolutionStrategy:
             return True
 
         # Area of distribution too small.
-        area = self.sigma * np.sqrt(max(self.cov.eigenvalues))
+        area = self.sigma * np.sqrt(np.max(self.cov.eigenvalues))
         if area < 1e-11:
             return True
 
@@ -181,6 +219,10 @@ class CMAEvolutionStrategy:
         )
         return solutions, out_of_bounds
 
+    def _calc_transform(self):
+        """Matrix mapping standard normal samples to the distribution."""
+        return self.cov.eigenbasis * np.sqrt(self.cov.eigenvalues)
+
     def ask(self, lower_bounds, upper_bounds):
         """Samples new solutions from the Gaussian distribution.
 
@@ -196,10 +238,15 @@ class CMAEvolutionStrategy:
         self.cov.update_eigensystem(self.current_eval, self.lazy_gap_evals)
         solutions = np.empty((self.batch_size, self.solution_dim),
                              dtype=self.dtype)
-        transform_mat = self.cov.eigenbasis * np.sqrt(self.cov.eigenvalues)
+        transform_mat = self._calc_transform()
+
+        lower_bounds = np.broadcast_to(lower_bounds, self.solution_dim
+                                       ).astype(self.dtype)
+        upper_bounds = np.broadcast_to(upper_bounds, self.solution_dim
+                                       ).astype(self.dtype)
 
         # Resampling method for bound constraints -> sample new solutions until
-        # all solutions are within bounds.
+        # all solutions are within bounds or the attempt budget is used up.
         remaining_indices = np.arange(self.batch_size)
         n_attempts = 0
         while len(remaining_indices) > 0:
@@ -220,35 +267,15 @@ class CMAEvolutionStrategy:
             out_of_bounds_indices = np.where(np.any(out_of_bounds, axis=1))[0]
             remaining_indices = remaining_indices[out_of_bounds_indices]
 
-            # -- Reflection -- 
-            # If number of resampling attempts is too high, 'reflect' parameters
-            # back into the feasible region. To do this we simply set the value
-            # of the parameter to the other side of the bound in the same amount
-            # as it exceeded the bound.
+            # -- Repair --
+            # Once the resampling budget is spent, move the parameters of the
+            # remaining solutions back into the feasible region.
             n_attempts += 1
-            if n_attempts > 10:
-                # n_out_of_bounds = np.sum(np.where(solutions>upper_bounds))
-                # n_out_of_bounds += np.sum(np.where(solutions<lower_bounds))
-                # print(f"0) Number of out of bounds variables: {n_out_of_bounds}")
-
-                for i in remaining_indices:
-                    for j in range(self.solution_dim):
-                        if solutions[i, j] < lower_bounds[j]:
-                            solutions[i, j] = (lower_bounds[j] +
-                                               (lower_bounds[j] -
-                                                solutions[i, j]))
-                            assert solutions[i, j] >= lower_bounds[j]
-                        elif solutions[i, j] > upper_bounds[j]:
-                            solutions[i, j] = (upper_bounds[j] -
-                                               (solutions[i, j] -
-                                                upper_bounds[j]))
-                            assert solutions[i, j] <= upper_bounds[j]
-
-                # n_out_of_bounds = np.sum(np.where(solutions>upper_bounds))
-                # n_out_of_bounds += np.sum(np.where(solutions<lower_bounds))
-                # print(f"1) Number of out of bounds variables: {n_out_of_bounds}\n") 
-                return np.asarray(solutions)
-   
+            if n_attempts > self.bound_attempts and len(remaining_indices) > 0:
+                repair = bound_repairs[self.bound_handling]
+                solutions[remaining_indices] = repair(
+                    solutions[remaining_indices], lower_bounds, upper_bounds)
+                break
 
         return np.asarray(solutions)
 
@@ -334,7 +361,7 @@ class CMAEvolutionStrategy:
 
         # Update the evolution path.
         y = self.mean - old_mean
-        z = np.matmul(self.cov.invsqrt, y)
+        z = self._whiten(y)
         self.ps = ((1 - cs) * self.ps +
                    (np.sqrt(cs * (2 - cs) * mueff) / self.sigma) * z)
         left = (np.sum(np.square(self.ps)) / self.solution_dim /
@@ -346,19 +373,181 @@ class CMAEvolutionStrategy:
                                                        (2 - cc) * mueff) * y)
 
         # Adapt the covariance matrix.
+        c1a = c1 * (1 - (1 - hsig**2) * cc * (2 - cc))
+        self._adapt_cov(parents, old_mean, weights, c1a, cmu, c1)
+
+        # Update sigma.
+        cn, sum_square_ps = cs / damps, np.sum(np.square(self.ps))
+        self.sigma *= np.exp(
+            min(1,
+                cn * (sum_square_ps / self.solution_dim - 1) / 2))
+
+    def _whiten(self, y):
+        """Multiplies y with C^(-1/2)."""
+        return np.matmul(self.cov.invsqrt, y)
+
+    def _adapt_cov(self, parents, old_mean, weights, c1a, cmu, c1):
+        """Rank-one and rank-mu update of the covariance matrix."""
         weighted_ys, ys = self._calc_weighted_ys(parents, old_mean, weights)
         # Equivalent to calculating the outer product of each ys[i] with itself
         # and taking a weighted sum of the outer products. Unfortunately, numba
         # does not support einsum.
         rank_mu_update = np.einsum("ki,kj", weighted_ys, ys)
-        c1a = c1 * (1 - (1 - hsig**2) * cc * (2 - cc))
         self.cov.cov = self._calc_cov_update(self.cov.cov, c1a, cmu, c1,
                                              self.pc, self.sigma,
                                              rank_mu_update)
 
-        # Update sigma.
-        cn, sum_square_ps = cs / damps, np.sum(np.square(self.ps))
-        self.sigma *= np.exp(
-            min(1,
-                cn * (sum_square_ps / self.solution_dim - 1) / 2))
 
+class DiagonalMatrix:
+    """Maintains a diagonal covariance matrix.
+
+    With a diagonal matrix the eigenvectors are the coordinate axes and the
+    eigenvalues are the diagonal itself, so the "eigendecomposition" is O(n)
+    and is simply redone whenever it is requested. Only the diagonals are
+    stored, making memory O(n) as well.
+
+    Args:
+        dimension (int): Size of the (square) covariance matrix.
+        dtype (str or data-type): Data type of the matrix, typically np.float32
+            or np.float64.
+    """
+
+    def __init__(self, dimension, dtype):
+        self.cov = np.ones((dimension,), dtype=dtype)  # diag(C)
+        self.eigenvalues = np.ones((dimension,), dtype=dtype)
+        self.condition_number = 1
+        self.invsqrt = np.ones((dimension,), dtype=dtype)  # diag(C^(-1/2))
+        self.dtype = dtype
+
+        # The last evaluation on which the eigensystem was updated.
+        self.updated_eval = 0
+
+    def update_eigensystem(self, current_eval, lazy_gap_evals):
+        """Updates the eigenvalues and inverse square root, lazy_gap_evals is
+        ignored as this is cheap."""
+        self.eigenvalues = self.cov.copy()
+        self.condition_number = (np.max(self.eigenvalues) /
+                                 np.min(self.eigenvalues))
+        self.invsqrt = 1 / np.sqrt(self.eigenvalues)
+        self.updated_eval = current_eval
+
+
+class SeparableCMAEvolutionStrategy(CMAEvolutionStrategy):
+    """Separable CMA-ES (sep-CMA-ES) with a diagonal covariance matrix.
+
+    Only variances along the coordinate axes are adapted, which cannot learn
+    rotated dependencies between parameters, but sampling and updates are
+    O(n) instead of O(n^2) (and O(n^3) for the eigendecomposition), and the
+    emitter holds no n x n matrices. Because there are only n parameters to
+    learn, the covariance learning rates are increased by (n + 2) / 3, as
+    proposed in:
+
+    Ros and Hansen, "A Simple Modification in CMA-ES Achieving Linear Time
+    and Space Complexity", PPSN 2008.
+
+    Takes the same arguments as CMAEvolutionStrategy.
+    """
+
+    def _init_cov(self):
+        return DiagonalMatrix(self.solution_dim, self.dtype)
+
+    @staticmethod
+    def _calc_strat_params(solution_dim, num_parents, weight_rule):
+        """Calculates CMA-ES parameters with sep-CMA learning rates."""
+        weights, mueff, cc, cs, c1, cmu = (
+            CMAEvolutionStrategy._calc_strat_params(solution_dim, num_parents,
+                                                    weight_rule))
+        c1 = c1 * (solution_dim + 2) / 3
+        cmu = min(1 - c1, cmu * (solution_dim + 2) / 3)
+        return weights, mueff, cc, cs, c1, cmu
+
+    def _calc_transform(self):
+        return np.sqrt(self.cov.eigenvalues)
+
+    @staticmethod
+    @nb.jit(nopython=True)
+    def _transform_and_check_sol(unscaled_params, transform_mat, mean,
+                                 lower_bounds, upper_bounds):
+        """Numba helper for scaling parameters to the solution space."""
+        solutions = (unscaled_params * np.expand_dims(transform_mat, axis=0) +
+                     np.expand_dims(mean, axis=0))
+        out_of_bounds = np.logical_or(
+            solutions < np.expand_dims(lower_bounds, axis=0),
+            solutions > np.expand_dims(upper_bounds, axis=0),
+        )
+        return solutions, out_of_bounds
+
+    def _whiten(self, y):
+        return self.cov.invsqrt * y
+
+    @staticmethod
+    @nb.jit(nopython=True)
+    def _calc_diag_update(cov, c1a, cmu, c1, pc, sigma, weighted_ys, ys):
+        """Calculates the update of the covariance diagonal."""
+        rank_mu_update = np.sum(weighted_ys * ys, axis=0)
+        return (cov * (1 - c1a - cmu) + c1 * pc**2 +
+                rank_mu_update * cmu / (sigma**2))
+
+    def _adapt_cov(self, parents, old_mean, weights, c1a, cmu, c1):
+        """Rank-one and rank-mu update of the covariance diagonal."""
+        weighted_ys, ys = self._calc_weighted_ys(parents, old_mean, weights)
+        self.cov.cov = self._calc_diag_update(self.cov.cov, c1a, cmu, c1,
+                                              self.pc, self.sigma,
+                                              weighted_ys, ys)
+
+
+cma_lookup = {"full" : CMAEvolutionStrategy,
+              "sep"  : SeparableCMAEvolutionStrategy}
+
+
+
+# - Bound handling ------------------------------------------------------------#
+@nb.jit(nopython=True)
+def reflect_bounds(solutions, lower_bounds, upper_bounds):
+    """Mirrors parameters at the bound they exceed, folding them back and forth
+    between both bounds until they are inside."""
+    for i in range(solutions.shape[0]):
+        for j in range(solutions.shape[1]):
+            x, lb, ub = solutions[i, j], lower_bounds[j], upper_bounds[j]
+            if lb <= x <= ub:
+                continue
+            width = ub - lb
+            if width == 0:
+                x = lb
+            elif np.isinf(width):
+                x = 2 * lb - x if x < lb else 2 * ub - x
+            else:
+                y = (x - lb) % (2 * width)
+                x = lb + (y if y <= width else 2 * width - y)
+            solutions[i, j] = x
+    return solutions
+
+
+@nb.jit(nopython=True)
+def wrap_bounds(solutions, lower_bounds, upper_bounds):
+    """Treats the bounds as periodic, dimensions without both bounds are
+    clipped instead."""
+    for i in range(solutions.shape[0]):
+        for j in range(solutions.shape[1]):
+            x, lb, ub = solutions[i, j], lower_bounds[j], upper_bounds[j]
+            if lb <= x <= ub:
+                continue
+            width = ub - lb
+            if width == 0 or np.isinf(width):
+                x = min(max(x, lb), ub)
+            else:
+                x = lb + (x - lb) % width
+            solutions[i, j] = x
+    return solutions
+
+
+def clip_bounds(solutions, lower_bounds, upper_bounds):
+    """Sets parameters to the bound they exceed."""
+    return np.clip(solutions, lower_bounds, upper_bounds)
+
+
+bound_repairs = {"resample"         : None,
+                 "reflect"          : reflect_bounds,
+                 "clip"             : clip_bounds,
+                 "wrap"             : wrap_bounds,
+                 "resample_reflect" : reflect_bounds}
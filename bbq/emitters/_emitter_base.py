@@ -1,7 +1,6 @@
 """Provides EmitterBase."""
-import itertools
-
 import numpy as np
+from bbq.emitters._pulse import PulseHistory
 from ribs.emitters._emitter_base import EmitterBase
 
 
@@ -11,18 +10,38 @@ class Bbq_Emitter():
     As vanilla pyribs but with:
     
     -) Pulse: logging of emitter effectiveness in adding and improving solutions
+              (only the latest `pulse_window` generations if one is given)
+    -) ask_ahead: whether it may be asked again before its last batch is told,
+              only for emitters that keep no state between ask and tell
+              (see map_elites.steady_state)
     """
-    def __init__(self, name):
+    ask_ahead = False
+
+    def __init__(self, name, pulse_window=None):
         self.name  = name
-        self.pulse = np.zeros((1,3), int)
+        self.pulse_history = PulseHistory(pulse_window)
+
+    @property
+    def pulse(self):
+        """(n_gens, 3) array of NOT_ADDED | IMPROVE | NEW counts"""
+        return self.pulse_history.array
+
+    def get_state(self):
+        """Random number generator and pulse history, emitters with more state
+        add theirs. Arrays are not copied."""
+        return {'rng': self._rng.bit_generator.state,
+                'pulse': self.pulse_history.get_state()}
 
+    def set_state(self, state):
+        """Restores a state from :meth:`get_state`"""
+        self._rng.bit_generator.state = state['rng']
+        self.pulse_history.set_state(state['pulse'])
 
     def tell(self, solutions, objective_values, behavior_values, metadata=None):
         """Inserts entries into the archive.
 
-        This base class implementation (in :class:`~ribs.emitters.EmitterBase`)
-        simply inserts entries into the archive by calling
-        :meth:`~ribs.archives.ArchiveBase.add`. It is enough for simple emitters
+        This base class implementation simply inserts the whole batch into the
+        archive with one call to ``add_batch``. It is enough for simple emitters
         like :class:`~ribs.emitters.GaussianEmitter`, but more complex emitters
         will almost certainly need to override it.
 
@@ -36,10 +55,7 @@ class Bbq_Emitter():
             metadata (numpy.ndarray): 1D object array containing a metadata
                 object for each solution.
         """
-        pulse = np.zeros(3) # NOT_ADDED | IMPROVE | NEW
-        metadata = itertools.repeat(None) if metadata is None else metadata
-        for sol, obj, beh, meta in zip(solutions, objective_values,
-                                       behavior_values, metadata):
-            status, value = self.archive.add(sol, obj, beh, meta)
-            pulse[status] += 1
-        self.pulse = np.vstack([self.pulse, pulse])
+        status, _ = self.archive.add_batch(solutions, objective_values,
+                                           behavior_values, metadata)
+        pulse = np.bincount(status, minlength=3) # NOT_ADDED | IMPROVE | NEW
+        self.pulse_history.append(pulse)
@@ -11,8 +11,9 @@ emitter_lookup = {'Cma'    : Bbq_Cma,
 def init_emitter(p, archive, start_xx=None, emitter_lookup=emitter_lookup):
     "Initializes emitters from list of emitter configs"
     emitters = []
+    n_params = p['n_params'] if 'n_params' in p else p['n_dof']
     for emitter in p['emitters']:
-        emitter['bounds'] = [p['param_bounds']]*p['n_params']
+        emitter['bounds'] = [p['param_bounds']]*n_params
         emitter['x0'] = start_xx[np.random.randint(len(start_xx))]
         emitter_type = emitter_lookup[emitter['type']]
         emitters += [emitter_type(archive, **emitter)]
@@ -0,0 +1,73 @@
+"""Growable record of emitter pulses."""
+import numpy as np
+
+
+class PulseHistory():
+    """Per generation counts of NOT_ADDED | IMPROVE | NEW solutions.
+
+    Rows are written into a preallocated int array which doubles in size when
+    full, so appending is amortized O(1) instead of copying the whole history
+    every generation. With a ``window`` only the latest ``window`` generations
+    are kept: the buffer is capped at twice the window and the live rows are
+    slid back to the front when it fills up.
+
+    Args:
+        window (int): Number of latest generations to keep, None keeps all.
+        n_events (int): Number of counts per generation.
+        capacity (int): Initial number of rows allocated.
+    """
+    def __init__(self, window=None, n_events=3, capacity=64):
+        if window is not None:
+            capacity = min(capacity, 2 * window)
+        self.window = window
+        self._data = np.zeros((capacity, n_events), dtype=int)
+        self._start = 0
+        self._stop = 0
+        self.n_total = 0  # Generations recorded, including those dropped
+        self.totals = np.zeros(n_events, dtype=int) # Counts over all of them
+
+    def __len__(self):
+        return self._stop - self._start
+
+    @property
+    def array(self):
+        """``(n_gens, n_events)`` view of the recorded pulses"""
+        return self._data[self._start:self._stop]
+
+    @property
+    def last(self):
+        """Counts of the latest generation (zeros if nothing is recorded)"""
+        if len(self) == 0:
+            return np.zeros(self._data.shape[1], dtype=int)
+        return self._data[self._stop - 1]
+
+    def append(self, counts):
+        """Records the counts of one generation"""
+        if self._stop == len(self._data):
+            self._make_room()
+        self._data[self._stop] = counts
+        self._stop += 1
+        self.n_total += 1
+        self.totals += self._data[self._stop - 1]
+        if self.window is not None and len(self) > self.window:
+            self._start += 1
+
+    def _make_room(self):
+        live = self.array.copy()
+        if self.window is None or len(self._data) < 2 * self.window:
+            size = 2 * len(self._data)
+            if self.window is not None:
+                size = min(size, 2 * self.window)
+            self._data = np.zeros((size, self._data.shape[1]), dtype=int)
+        self._data[:len(live)] = live
+        self._start, self._stop = 0, len(live)
+
+    def get_state(self):
+        return {'data': self._data, 'start': self._start, 'stop': self._stop,
+                'n_total': self.n_total, 'totals': self.totals}
+
+    def set_state(self, state):
+        self._data = np.array(state['data'])
+        self._start, self._stop = state['start'], state['stop']
+        self.n_total = state['n_total']
+        self.totals = np.array(state['totals'])
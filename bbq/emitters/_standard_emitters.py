@@ -6,43 +6,117 @@ from ribs.emitters._iso_line_emitter import IsoLineEmitter
 from ribs.emitters._improvement_emitter import ImprovementEmitter
 from ribs.emitters._emitter_base import EmitterBase
 
-import itertools
 from ribs.archives import AddStatus
 import numpy as np
 #from ribs.emitters.opt import CMAEvolutionStrategy
-from bbq.emitters._cma_es import CMAEvolutionStrategy # BBQ version with reflection
+from bbq.emitters._cma_es import cma_lookup # BBQ versions with reflection
 
 
 class Bbq_Gauss(Bbq_Emitter, GaussianEmitter):
-    def __init__(self, archive, x0, sigma0, bounds=None, batch_size=64, seed=None, name='--', **_):
+    ask_ahead = True # parents are drawn from the archive at every ask
+
+    def __init__(self, archive, x0, sigma0, bounds=None, batch_size=64, seed=None, name='--', pulse_window=None, **_):
         GaussianEmitter.__init__(self, archive, x0, sigma0, bounds, batch_size, seed=None)
-        Bbq_Emitter.__init__(self, name)
+        Bbq_Emitter.__init__(self, name, pulse_window)
+
+    def ask(self):
+        """ As GaussianEmitter.ask, with all parents drawn in one call """
+        if self.archive.empty:
+            parents = np.expand_dims(self._x0, axis=0)
+        else:
+            parents = self.archive.sample_elites(self._batch_size).sol
+
+        noise = self._rng.normal(
+            scale=self._sigma0,
+            size=(self._batch_size, self.solution_dim),
+        ).astype(self.archive.dtype)
+
+        return self._ask_clip_helper(parents, noise,
+                                     self.lower_bounds, self.upper_bounds)
 
 class Bbq_Line(Bbq_Emitter, IsoLineEmitter):
-    def __init__(self, archive, x0, iso_sigma=0.01, line_sigma=0.2, bounds=None, batch_size=64, seed=None, name='--', **_):
+    ask_ahead = True # parents are drawn from the archive at every ask
+
+    def __init__(self, archive, x0, iso_sigma=0.01, line_sigma=0.2, bounds=None, batch_size=64, seed=None, name='--', pulse_window=None, **_):
         IsoLineEmitter.__init__(self, archive, x0, iso_sigma, line_sigma, 
                                 bounds, batch_size, seed)
-        Bbq_Emitter.__init__(self, name)
+        Bbq_Emitter.__init__(self, name, pulse_window)
+
+    def ask(self):
+        """ As IsoLineEmitter.ask, with parents and the elites giving their
+        line directions drawn in one call """
+        iso_gaussian = self._rng.normal(
+            scale=self._iso_sigma,
+            size=(self._batch_size, self.solution_dim),
+        ).astype(self.archive.dtype)
+
+        if self.archive.empty:
+            solutions = np.expand_dims(self._x0, axis=0) + iso_gaussian
+        else:
+            elites = self.archive.sample_elites(2 * self._batch_size).sol
+            parents = elites[:self._batch_size]
+            directions = elites[self._batch_size:] - parents
+            line_gaussian = self._rng.normal(
+                scale=self._line_sigma,
+                size=(self._batch_size, 1),
+            ).astype(self.archive.dtype)
+
+            solutions = self._ask_solutions_numba(parents, iso_gaussian,
+                                                  line_gaussian, directions)
+
+        return self._ask_clip_helper(solutions, self.lower_bounds,
+                                     self.upper_bounds)
 
 class Bbq_Cma(Bbq_Emitter, ImprovementEmitter):
-    def __init__(self, archive, x0, sigma0, selection_rule="filter", restart_rule="no_improvement", weight_rule="truncation", bounds=None, batch_size=None, seed=None, name='--', **_):
-        ImprovementEmitter.__init__(self, archive, x0, sigma0, selection_rule, 
-                                      restart_rule, weight_rule, bounds, 
-                                      batch_size, seed)
+    # batches come from the current distribution, which tell moves (or resets)
+    ask_ahead = False
+
+    def __init__(self, archive, x0, sigma0, selection_rule="filter", restart_rule="no_improvement", weight_rule="truncation", bounds=None, batch_size=None, seed=None, name='--', pulse_window=None, bound_handling="resample_reflect", bound_attempts=10, cma_type="full", **_):
+        # Same setup as ImprovementEmitter.__init__, which would also build
+        # (and throw away) a full covariance CMA-ES with several n x n matrices
+        self._rng = np.random.default_rng(seed)
+        self._x0 = np.array(x0, dtype=archive.dtype)
+        self._sigma0 = sigma0
+        EmitterBase.__init__(self, archive, len(self._x0), bounds)
+
+        if selection_rule not in ["mu", "filter"]:
+            raise ValueError(f"Invalid selection_rule {selection_rule}")
+        self._selection_rule = selection_rule
+
+        if restart_rule not in ["basic", "no_improvement"]:
+            raise ValueError(f"Invalid restart_rule {restart_rule}")
+        self._restart_rule = restart_rule
+
         opt_seed = None if seed is None else self._rng.integers(10_000)
-        self.opt = CMAEvolutionStrategy(sigma0, batch_size, self._solution_dim,
-                                        weight_rule, opt_seed,
-                                        self.archive.dtype)  
+        self.opt = cma_lookup[cma_type](sigma0, batch_size,
+                                        self._solution_dim, weight_rule,
+                                        opt_seed, self.archive.dtype,
+                                        bound_handling, bound_attempts)
         self.opt.reset(self._x0)              
+        self._num_parents = (self.opt.batch_size //
+                             2 if selection_rule == "mu" else None)
+        self._batch_size = self.opt.batch_size
+        self._restarts = 0
         
-        Bbq_Emitter.__init__(self, name)
+        Bbq_Emitter.__init__(self, name, pulse_window)
+
+    def get_state(self):
+        state = super().get_state()
+        state['opt'] = self.opt.get_state()
+        state['restarts'] = self._restarts
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.opt.set_state(state['opt'])
+        self._restarts = state['restarts']
 
     def tell(self, solutions, objective_values, behavior_values, metadata=None):
         """Gives the emitter results from evaluating solutions.
 
     As solutions are inserted into the archive, we record their "improvement
-    value" -- conveniently, this is the ``value`` returned by
-    :meth:`ribs.archives.ArchiveBase.add`. We then rank the solutions
+    value" -- conveniently, this is the ``value`` returned by the archive's
+    ``add_batch``. We then rank the solutions
     according to their add status (new solutions rank in front of
     solutions that improved existing entries in the archive, which rank
     ahead of solutions that were not added), followed by their improvement
@@ -59,23 +133,15 @@ class Bbq_Cma(Bbq_Emitter, ImprovementEmitter):
         metadata (numpy.ndarray): 1D object array containing a metadata
             object for each solution.
     """
-        pulse = np.zeros(3) # NOT_ADDED | IMPROVE | NEW
-        ranking_data = []
-        new_sols = 0
-        metadata = itertools.repeat(None) if metadata is None else metadata
-        for i, (sol, obj, beh, meta) in enumerate(
-                zip(solutions, objective_values, behavior_values, metadata)):
-            status, value = self.archive.add(sol, obj, beh, meta)
-            ranking_data.append((status, value, i))
-            if status in (AddStatus.NEW, AddStatus.IMPROVE_EXISTING):
-                new_sols += 1
-            pulse[status] += 1
-        self.pulse = np.vstack([self.pulse, pulse])
+        status, value = self.archive.add_batch(solutions, objective_values,
+                                               behavior_values, metadata)
+        pulse = np.bincount(status, minlength=3) # NOT_ADDED | IMPROVE | NEW
+        new_sols = pulse[AddStatus.NEW] + pulse[AddStatus.IMPROVE_EXISTING]
+        self.pulse_history.append(pulse)
         
         # New solutions sort ahead of improved ones, which sort ahead of ones
         # that were not added.
-        ranking_data.sort(reverse=True)
-        indices = [d[2] for d in ranking_data]
+        indices = np.lexsort((value, status))[::-1]
 
         num_parents = (new_sols if self._selection_rule == "filter" else
                     self._num_parents)
@@ -83,9 +149,9 @@ class Bbq_Cma(Bbq_Emitter, ImprovementEmitter):
         self.opt.tell(solutions[indices], num_parents)
 
         # Check for reset.
-        if (self.opt.check_stop([value for status, value, i in ranking_data]) or
+        if (self.opt.check_stop(value[indices]) or
                 self._check_restart(new_sols)):
-            new_x0 = self.archive.get_random_elite().sol
+            new_x0 = self.archive.sample_elites(1).sol[0]
             self.opt.reset(new_x0)
             self._restarts += 1
                     
@@ -93,10 +159,11 @@ class Bbq_Object(Bbq_Emitter, EmitterBase):
     """Emits solutions by calling object class mutate function on 
          existing archive solutions.
     """
+    ask_ahead = True
 
-    def __init__(self, archive, mut_p, batch_size=64, seed=None, name='--', **_):
+    def __init__(self, archive, mut_p, batch_size=64, seed=None, name='--', pulse_window=None, **_):
         EmitterBase.__init__(self, archive, 1, None)
-        Bbq_Emitter.__init__(self, name)
+        Bbq_Emitter.__init__(self, name, pulse_window)
         self._p = mut_p
         self._batch_size = batch_size
         self._rng = np.random.default_rng(seed)
@@ -121,9 +188,6 @@ class Bbq_Object(Bbq_Emitter, EmitterBase):
         if self.archive.empty:
             raise ValueError("Cannot ask on empty archive")
         else:
-            parents = [
-                self.archive.get_random_elite().sol[0]
-                for _ in range(self._batch_size)
-            ]
+            parents = self.archive.sample_elites(self._batch_size).sol
         children = [parent.mutate(self._p) for parent in parents]
         return children
\ No newline at end of file
@@ -9,13 +9,13 @@ class PlanarArm(BbqDomain):
         BbqDomain.__init__(self, **kwargs)        
     
     def _fitness(self, x):        
-        return 1 - np.std(x)
+        return 1 - np.std(x, axis=-1)
     
     def _desc(self, thetas):
-        c = np.cumsum(thetas)
-        x = np.sum(np.cos(c)) / (2. * len(thetas)) + 0.5
-        y = np.sum(np.sin(c)) / (2. * len(thetas)) + 0.5
-        return np.array((x,y))
+        c = np.cumsum(thetas, axis=-1)
+        x = np.sum(np.cos(c), axis=-1) / (2. * thetas.shape[-1]) + 0.5
+        y = np.sum(np.sin(c), axis=-1) / (2. * thetas.shape[-1]) + 0.5
+        return np.stack((x,y), axis=-1)
 
     def express(self, x):
         pheno = scale(x, [-math.pi, math.pi])
@@ -36,6 +36,12 @@ class PlanarArm(BbqDomain):
         desc = self._desc(pheno)
         return obj, desc, pheno        
 
+    def evaluate_batch(self, xx):
+        xx = np.asarray(xx)
+        pheno = self.express(xx)
+        metas = [row.copy() for row in pheno] # rows alone, not views of the batch
+        return self._fitness(xx), self._desc(pheno), metas
+
 
 def visualize(solution, ax):
     """Plots an arm with the given angles and link lengths on ax.
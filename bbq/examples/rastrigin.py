@@ -9,15 +9,20 @@ class Rastrigin(BbqDomain):
         BbqDomain.__init__(self, **kwargs)        
     
     def _fitness(self, x):        
-        f = 10 * x.shape[0] + (x * x - 10 * np.cos(2 * math.pi * x)).sum()
-        return -f + 2*x.shape[0]**2 # Shift to make QD score increasing
+        f = 10 * x.shape[-1] + (x * x - 10 * np.cos(2 * math.pi * x)).sum(axis=-1)
+        return -f + 2*x.shape[-1]**2 # Shift to make QD score increasing
     
     def _desc(self, x):
-        return np.array(x[0:2])
+        return np.array(x[...,0:2])
 
     def express(self, x):
         return scale(x, self.param_bounds)
 
+    def evaluate_batch(self, xx):
+        pheno = self.express(np.asarray(xx))
+        metas = [row.copy() for row in pheno] # rows alone, not views of the batch
+        return self._fitness(pheno), self._desc(pheno), metas
+
 """Example using objects as genomes.
 
 - Method for generating new individuals is contained within object (mutate)
@@ -41,6 +46,14 @@ class Rastrigin_Obj(Rastrigin):
 
     def express(self, x):
         return super().express(x.genome) # Evaluate values inside of class
+
+    def cache_genome(self, x):
+        return x.genome
+
+    def evaluate_batch(self, xx):
+        pheno = scale(np.array([x.genome for x in xx]), self.param_bounds)
+        metas = [row.copy() for row in pheno] # rows alone, not views of the batch
+        return self._fitness(pheno), self._desc(pheno), metas
     
     def init(self, n_solutions):
         initial_genomes = np.random.rand(n_solutions, self.n_dof)
@@ -0,0 +1,144 @@
+"""Runs sweeps of experiments and replicates on a local process pool
+
+    python -m bbq.experiment.runner bbq.examples.rastrigin:Rastrigin \
+        config/d_rast.yaml,config/x_test.yaml,config/e_gauss.yaml \
+        config/d_rast.yaml,config/x_test.yaml,config/e_cmame.yaml --reps=5
+
+Each argument after the domain is one experiment: config files separated by
+commas, combined as in a single run. Every experiment is run `reps` times,
+each replicate logging to its own `log/<task>/<exp>/<rep>` folder, where
+`<exp>` is the `exp_name` of the configs or the one given for the experiment
+in `exp_names`. Runs that
+already finished are skipped, and runs that were stopped continue from their
+last saved state (see `resume`), so the same command can be started again
+after an interruption.
+
+The cores are split between runs and the evaluators inside them: as many
+runs as possible go at once, and cores left over when there are fewer runs
+than cores are given to their evaluators as `n_workers`.
+"""
+import importlib
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+from multiprocessing import get_context
+
+import fire
+
+from bbq.archives.centroids import precompute_centroids
+from bbq.logging.logger import RibsLogger, is_done, log_path
+from bbq.map_elites import map_elites
+from bbq.utils import load_config
+
+
+def split_cores(n_runs, cores, n_workers=None):
+    """ Runs at once and evaluation workers per run, for `cores` in total.
+    With `n_workers` given only the number of runs is chosen. """
+    if n_workers is None:
+        n_parallel = max(1, min(n_runs, cores))
+        n_workers = max(1, cores // n_parallel)
+    else:
+        n_parallel = max(1, min(n_runs, cores // n_workers))
+    return n_parallel, n_workers
+
+
+def load_domain(domain):
+    """ Domain class, or imports it from a 'module:Class' string """
+    if not isinstance(domain, str):
+        return domain
+    module, name = domain.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def run_config(config_files, n_workers=1, exp_name=None):
+    """ Parameters of one run as set by the runner """
+    p = load_config(config_files)
+    if exp_name is not None:
+        p['exp_name'] = exp_name
+    p['n_workers'] = n_workers
+    if n_workers > 1:
+        p.setdefault('evaluator', 'processes')
+    p['resume'] = True # continue a stopped run instead of starting over
+    return p
+
+
+def run_one(domain, config_files, rep=0, root_path="", n_workers=1,
+            exp_name=None):
+    """ Runs a single replicate, console output goes to `output.txt` in its
+    log folder. Returns the log folder and the time it took. """
+    start = time.time()
+    p = run_config(config_files, n_workers, exp_name)
+    logger = RibsLogger(p, rep=rep, root_path=root_path)
+    with open(logger.log_dir / 'output.txt', 'a') as out, \
+            redirect_stdout(out), redirect_stderr(out):
+        map_elites(load_domain(domain)(**p), p, logger)
+    return logger.log_dir, time.time() - start
+
+
+def run_experiments(domain, *configs, reps=1, root_path="", cores=None,
+                    n_workers=None, rerun=False, exp_names=None):
+    """ Runs every experiment in `configs` `reps` times on a process pool.
+
+    Args:
+        domain (str or class): Domain class, or 'module:Class' to import it.
+        configs: One entry per experiment, config files separated by commas
+            or a list of config files.
+        reps (int): Replicates of each experiment.
+        root_path (str): Folder the `log` folder is in.
+        cores (int): Cores to use, all of them if None.
+        n_workers (int): Evaluation workers of each run, chosen from the
+            number of runs and cores if None.
+        rerun (bool): Also run replicates that already finished.
+        exp_names (list or str): Name of each experiment, separated by
+            commas if a string, instead of the `exp_name` of its configs.
+    Returns:
+        list: Log folders of runs that failed.
+    """
+    if isinstance(exp_names, str):
+        exp_names = exp_names.split(',')
+    if exp_names is None:
+        exp_names = [None] * len(configs)
+    elif len(exp_names) != len(configs):
+        raise ValueError(f"{len(exp_names)} exp_names for {len(configs)} "
+                         "experiments")
+    jobs = []
+    for config, exp_name in zip(configs, exp_names):
+        files = config.split(',') if isinstance(config, str) else list(config)
+        p = run_config(files, exp_name=exp_name)
+        for rep in range(reps):
+            if rerun or not is_done(p, rep, root_path):
+                jobs.append((files, rep, exp_name))
+            else:
+                print(f"Skipping finished {log_path(p, rep, root_path)}")
+    if not jobs:
+        return []
+
+    cores = cores or os.cpu_count()
+    n_parallel, n_workers = split_cores(len(jobs), cores, n_workers)
+    print(f"[*] {len(jobs)} runs, {n_parallel} at once with "
+          f"{n_workers} evaluation worker(s) each")
+    precompute_centroids(*{tuple(files) for files, _, _ in jobs})
+
+    failed = []
+    # Fresh interpreters, forked runs would share random number generators
+    with ProcessPoolExecutor(n_parallel, mp_context=get_context('spawn')) as pool:
+        futures = {pool.submit(run_one, domain, files, rep, root_path,
+                               n_workers, exp_name): (files, rep, exp_name)
+                   for files, rep, exp_name in jobs}
+        for i, future in enumerate(as_completed(futures)):
+            files, rep, exp_name = futures[future]
+            run = log_path(run_config(files, exp_name=exp_name), rep, root_path)
+            try:
+                _, run_time = future.result()
+                print(f"[{i+1}/{len(jobs)}] {run} done in {run_time:.0f}s")
+            except Exception:
+                traceback.print_exc()
+                print(f"[{i+1}/{len(jobs)}] {run} failed")
+                failed.append(str(run))
+    return failed
+
+
+if __name__ == '__main__':
+    fire.Fire(run_experiments)
@@ -4,6 +4,7 @@ import json
 from matplotlib.ticker import FormatStrFormatter
 from matplotlib import pyplot as plt
 from pathlib import Path
+from bbq.logging.metrics import load_metrics
 
 
 def load_json(fname):
@@ -21,9 +22,7 @@ def get_stats(exp, stat_name):
         dir_name = str(e)
         rep_folders = next(os.walk(dir_name))[1]    
         for rep in rep_folders:
-            fname = e/rep/'metrics.json'
-            #print(fname)
-            stat_tmp = load_json(fname)
+            stat_tmp = load_metrics(e/rep) # memory mapped
             stat_list.append(stat_tmp[stat_name]['vals'])
         stat[e.name]['full'] = np.stack(stat_list)
 
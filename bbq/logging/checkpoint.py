@@ -0,0 +1,213 @@
+""" Incremental archive checkpoints
+
+Each save writes only the bins that changed since the previous save (a delta),
+on top of an occasional full copy of the occupied bins (a base). A new base is
+written once the deltas since the last one hold as many bins as the archive,
+so the checkpoints take at most about twice the space of one full copy.
+`manifest.json` lists the saves in order and points at the latest one.
+
+Every file is an `.npz` of the bins it holds:
+    index     - flat bin index into the archive storage
+    objective - objective value of the elite in the bin
+    behavior  - behavior values of the elite
+    solution  - solution of the elite
+    metadata  - metadata of the elite (object array)
+
+The full state of a run, to resume it, is saved separately with `save_state`.
+"""
+import copy
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+class ArchiveCheckpoints():
+    """ Writes incremental checkpoints of an archive into `archive_dir` """
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.manifest = None
+        self.n_delta = 0    # bins stored in deltas since the last base
+        self.n_clear = None # archive clears seen at the last base
+
+    def resume(self, itr):
+        """ Continues the checkpoints of a run resumed from iteration `itr`,
+        forgetting later ones. The next save is a base, as changes made before
+        `itr` might not have been saved. """
+        if (self.archive_dir / 'manifest.json').exists():
+            self.manifest = read_manifest(self.archive_dir)
+            self.manifest['checkpoints'] = [
+                c for c in self.manifest['checkpoints'] if c['itr'] <= itr]
+            last = self.manifest['checkpoints'][-1:]
+            self.manifest['latest'] = last[0]['itr'] if last else None
+        self.n_delta, self.n_clear = 0, None
+
+    def save(self, archive, itr, changed):
+        """ Saves the bins in `changed` (flat indices, see
+        `BBQArchiveBase.pop_changes`), or a base when one is due """
+        ckpt = self.collect(archive, itr, changed)
+        if ckpt is not None:
+            self.write(ckpt)
+
+    def collect(self, archive, itr, changed):
+        """ Copies of the bins `save` would write and the manifest after it,
+        to `write` on another thread while the search changes the archive.
+        None if there is nothing new to save. """
+        occupied = archive._occupied.reshape(-1)
+        if self.manifest is None:
+            self.manifest = {'behavior_dim': int(archive._behavior_dim),
+                             'solution_dim': int(archive._solutions.shape[-1]),
+                             'solution_dtype': str(archive._solutions.dtype),
+                             'checkpoints': [], 'latest': None}
+        # storage of sparse archives grows, the latest size holds every save
+        self.manifest['storage_dims'] = [int(d) for d in archive._storage_dims]
+        n_occupied = int(np.count_nonzero(occupied))
+        if (self.n_clear != archive._state['clear'] or
+                self.n_delta + len(changed) > n_occupied):
+            kind, index = 'base', np.flatnonzero(occupied)
+            self.n_delta, self.n_clear = 0, archive._state['clear']
+        else:
+            kind, index = 'delta', changed[occupied[changed]]
+            if len(index) == 0 and self.manifest['latest'] == itr:
+                return None # already saved, e.g. by the final log
+            self.n_delta += len(index)
+
+        checkpoints = self.manifest['checkpoints']
+        fname = f'{len(checkpoints):04d}_{kind}_{itr}.npz'
+        n_sol = archive._solutions.shape[-1]
+        bins = {'index': index,
+            'objective': archive._objective_values.reshape(-1)[index],
+            'behavior': archive._behavior_values.reshape(-1, archive._behavior_dim)[index],
+            'solution': archive._solutions.reshape(-1, n_sol)[index],
+            'metadata': archive._metadata.reshape(-1)[index]}
+        checkpoints.append({'itr': int(itr), 'type': kind, 'file': fname})
+        self.manifest['latest'] = int(itr)
+        return {'file': fname, 'bins': bins,
+                'manifest': copy.deepcopy(self.manifest)}
+
+    def write(self, ckpt):
+        """ Writes a checkpoint from `collect`, in the order collected """
+        np.savez(self.archive_dir / ckpt['file'], **ckpt['bins'])
+        write_manifest(self.archive_dir, ckpt['manifest'])
+
+
+def write_manifest(archive_dir, manifest):
+    """ Replaces the manifest in one step, so readers never see half of it """
+    tmp = Path(archive_dir) / 'manifest.json.tmp'
+    with tmp.open('w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp, Path(archive_dir) / 'manifest.json')
+
+
+def read_manifest(archive_dir):
+    with (Path(archive_dir) / 'manifest.json').open() as file:
+        return json.load(file)
+
+
+def load_archive(archive_dir, itr=None):
+    """ Archive as saved at iteration `itr` (the latest save if None).
+
+    Returns the layout of `RibsLogger.archive_to_numpy`: 'fit', 'desc', 'x'
+    and 'meta' arrays in the shape of the archive storage (the grid, the
+    centroids of a CVT archive or the slots of a sparse grid), with nan in
+    empty bins.
+    """
+    archive_dir = Path(archive_dir)
+    manifest = read_manifest(archive_dir)
+    itr = manifest['latest'] if itr is None else itr
+    saved = [c for c in manifest['checkpoints'] if c['itr'] <= itr]
+    if not saved or saved[-1]['itr'] != itr:
+        raise ValueError(f"No checkpoint saved at iteration {itr}")
+    bases = [i for i, c in enumerate(saved) if c['type'] == 'base']
+    chain = saved[bases[-1]:]
+
+    dims = tuple(manifest['storage_dims'])
+    fit  = np.full(dims, np.nan)
+    desc = np.full((*dims, manifest['behavior_dim']), np.nan)
+    x    = np.full((*dims, manifest['solution_dim']), np.nan,
+                   dtype=manifest['solution_dtype'])
+    meta = np.full((*dims, 1), np.nan, dtype=object)
+    flat = [a.reshape(len(fit.reshape(-1)), -1) for a in (desc, x, meta)]
+    for c in chain:
+        with np.load(archive_dir / c['file'], allow_pickle=True) as ckpt:
+            index = ckpt['index']
+            fit.reshape(-1)[index] = ckpt['objective']
+            flat[0][index] = ckpt['behavior']
+            flat[1][index] = ckpt['solution']
+            flat[2][index, 0] = ckpt['metadata']
+    return {'fit': fit, 'desc': desc, 'x': x, 'meta': meta}
+
+
+# - Run state -----------------------------------------------------------------#
+def save_state(state_dir, state):
+    """ Writes the nested dict `state` of a run at iteration state['itr'].
+
+    Arrays and numpy scalars go into one `.npz` as raw arrays, everything else
+    (ints, floats, random number generator states) into a `.json` skeleton
+    that points at them. `latest.json` is switched to the new state once it
+    is complete, then the previous one is deleted, so a crash while saving
+    leaves the previous state intact.
+    """
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    arrays = {}
+    skeleton = _split(state, arrays, 'state')
+    name = f"state_{state['itr']}"
+    np.savez(state_dir / f'{name}.npz', **arrays)
+    with (state_dir / f'{name}.json').open('w') as file:
+        json.dump(skeleton, file)
+
+    previous = _read_latest(state_dir)
+    tmp = state_dir / 'latest.json.tmp'
+    with tmp.open('w') as file:
+        json.dump({'name': name}, file)
+    os.replace(tmp, state_dir / 'latest.json')
+    if previous is not None and previous != name:
+        for suffix in ('.npz', '.json'):
+            (state_dir / f'{previous}{suffix}').unlink(missing_ok=True)
+
+
+def load_state(state_dir):
+    """ Latest state written by `save_state`, None if there is none """
+    state_dir = Path(state_dir)
+    name = _read_latest(state_dir)
+    if name is None:
+        return None
+    with (state_dir / f'{name}.json').open() as file:
+        skeleton = json.load(file)
+    with np.load(state_dir / f'{name}.npz', allow_pickle=True) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+    return _join(skeleton, arrays)
+
+
+def _read_latest(state_dir):
+    latest = Path(state_dir) / 'latest.json'
+    if not latest.exists():
+        return None
+    with latest.open() as file:
+        return json.load(file)['name']
+
+
+def _split(obj, arrays, key):
+    """ Moves arrays out of a nested dict/list into `arrays` """
+    if isinstance(obj, dict):
+        return {k: _split(v, arrays, f'{key}/{k}') for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_split(v, arrays, f'{key}/{i}') for i, v in enumerate(obj)]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        arrays[key] = obj
+        return {'__array__': key}
+    return obj
+
+
+def _join(obj, arrays):
+    """ Inverse of `_split`, numpy scalars come back as numpy scalars """
+    if isinstance(obj, dict):
+        if '__array__' in obj:
+            array = arrays[obj['__array__']]
+            return array[()] if array.ndim == 0 else array
+        return {k: _join(v, arrays) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_join(v, arrays) for v in obj]
+    return obj
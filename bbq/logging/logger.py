@@ -1,13 +1,28 @@
 import matplotlib.pyplot as plt
 from pathlib import Path
-import json
 import shutil
+import random
+import json
 import numpy as np
-from bbq.logging.vis import view_map
+from bbq.logging.vis import view_map, view_elites
 from humanfriendly import format_timespan
 import pickle
 from bbq.logging.vis import plot_stats, plot_pulse, norm_pulse
 from ribs.visualize import cvt_archive_heatmap
+from bbq.logging.worker import LogWorker
+from bbq.logging.metrics import MetricsLog
+from bbq.logging.checkpoint import ArchiveCheckpoints, load_state, save_state
+from bbq.logging.timing import NULL_TIMER, format_seconds
+
+
+def log_path(p, rep=0, root_path=""):
+    ''' Folder a run logs to '''
+    return Path(f'{root_path}/log/{p["task_name"]}/{p["exp_name"]}/{rep}')
+
+
+def is_done(p, rep=0, root_path=""):
+    ''' Whether the run has finished, i.e. written its final log '''
+    return (log_path(p, rep, root_path) / 'done.json').exists()
 
 
 class RibsLogger():
@@ -15,165 +30,277 @@ class RibsLogger():
         self.p = p
         self.save_meta = save_meta      
         self.zip = zip  
-        self.metrics = {
-            "Archive Size": {
-                "itrs": [0],
-                "vals": [0],  # Starts at 0.
-                "label": ['Filled Bins'],
-            },
-            "Fitness": {
-                "itrs": [],
-                "vals": [],  # Does not start at 0.
-                "label": ['Mean Fitness', 'Max Fitness'],
-            },                  
-            "QD Score": {
-                "itrs": [],
-                "vals": [],  # Does not start at 0.
-                "label": ['QD Score'],
-            },    
-            "Improvement Ratio": {
-                "itrs": [],
-                "vals": [],  # Does not start at 0.
-                "label": ['Improvement'],
-            },              
-        }       
         # Set log folders
-        self.log_dir = Path(f'{root_path}/log/{p["task_name"]}/{p["exp_name"]}/{rep}')
-        if clear:
+        self.log_dir = log_path(p, rep, root_path)
+        self.state_dir = self.log_dir/'state'
+        # Continue a run that saved its state, see load_state
+        self.resuming = p.get('resume', False) and self.state_dir.exists()
+        if clear and not self.resuming:
             if self.log_dir.exists() and self.log_dir.is_dir():
                 shutil.rmtree(self.log_dir)
         self.log_dir.mkdir(parents=True,exist_ok=True)
         print(f"Logging to {self.log_dir}")
+        self.metrics = MetricsLog(self.log_dir, resume=self.resuming)
+
+        self.pulse_seen = None # pulse totals already counted per emitter
+
+        # Phase timings, see set_timer
+        self.timer = NULL_TIMER
+        self.timings = None
+
+        # Plot and save on a background thread, at most `async_logs` pending
+        self.worker = None
+        if p.get('async_logs', 0) > 0:
+            self.worker = LogWorker(p['async_logs'])
 
         self.archive_dir = self.log_dir/'archive'
         self.archive_dir.mkdir(parents=True,exist_ok=True)
+        self.checkpoints = ArchiveCheckpoints(self.archive_dir)
 
         if copy_config:
             self.copy_config()
+
+    def set_timer(self, timer):
+        ''' Times logging with `timer` and writes its phase times to
+        `timings.bin` with every `log_phases`, see bbq.logging.timing '''
+        self.timer = timer
+        if timer.enabled:
+            self.timings = MetricsLog(self.log_dir, {'Phase Times': timer.phases},
+                                      resume=self.resuming, name='timings',
+                                      zero_start=[])
         
-    def final_log(self, domain, archive, itr, time):
+    def final_log(self, opt, d, itr, time):
         ''' Final log method, allows for final visualization/evaluation options '''
-        self.log_metrics(domain, archive, itr, time, save_all=True)
+        self.log_metrics(opt, d, itr, time, save_all=True)
+        self.print_progress(opt, d, itr, time)
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+        self.metrics.close()
+        if self.timings is not None:
+            self.timings.close()
+        done = {'itr': itr, 'time': time}
+        if getattr(d, 'cache', None) is not None:
+            done['eval_cache'] = d.cache.stats
+        with open(self.log_dir / 'done.json', 'w') as f: # see is_done
+            json.dump(done, f)
         if self.zip:
             self.zip_results()
 
     def log_metrics(self, opt, d, itr, time, save_all=False):
-        ''' Calls all logging and visualization functions '''
+        ''' Calls all logging and visualization functions, the progress line
+        is printed separately by print_progress '''
         archive = opt.archive
         emitter = opt.emitters
+        start = self.timer.start()
         self.update_metrics(archive, emitter, itr)
+        self.timer.stop('log', start)
+
+        plot = (itr%self.p['plot_rate']==0) or save_all
+        save = (itr%self.p['save_rate']==0) or save_all
+        if not (plot or save): return
+        pulses = [e.pulse for e in emitter]
+        ckpt = None
+        if save:
+            start = self.timer.start()
+            ckpt = self.collect_archive(archive, itr)
+            self.timer.stop('save', start)
+        if self.worker is None:
+            self.write_logs(archive, pulses, self.metrics.n_rows, plot, save,
+                            ckpt, timer=self.timer)
+            return
+        # hand copies to the worker, the search keeps changing the originals:
+        # the checkpoint holds copies of its bins, the snapshot of the arrays
+        # that are plotted
+        start = self.timer.start()
+        self.worker.submit(self.write_logs, archive.snapshot() if plot else None,
+                           [pulse.copy() for pulse in pulses],
+                           self.metrics.n_rows, plot, save, ckpt)
+        self.timer.stop('log', start)
+
+    def write_logs(self, archive, pulses, n_rows, plot, save, ckpt=None,
+                   timer=NULL_TIMER):
+        ''' Plots and saves to disk, inline or on the worker thread. Saves
+        the checkpoint from collect_archive, if there is one. '''
+        start = timer.start()
+        if plot:
+            self.plot_metrics(n_rows)
+            self.plot_obj(archive)
+            self.plot_pulses(pulses)
+            start = timer.stop('plot', start)
+
+        if save:
+            if ckpt is not None:
+                self.checkpoints.write(ckpt)
+            self.save_pulse(pulses)
+            timer.stop('save', start)
+
+    def print_progress(self, opt, d, itr, time):
+        ''' Prints the progress line of iteration itr, called once it is
+        logged and saved so their times are in its phases '''
         if (itr==1 or itr%self.p['print_rate'] == 0) or self.p['print_rate'] == 1:
+            start = self.timer.start()
             n_evals = sum([emitter['batch_size'] for emitter in self.p['emitters']])
-            self.print_metrics(archive, itr, n_evals, time)  
-            with (self.log_dir / f"metrics.json").open("w") as file:
-                json.dump(self.metrics, file, indent=2)        
+            self.print_metrics(opt.archive, itr, n_evals, time,
+                               getattr(d, 'cache', None))
+            self.timer.stop('log', start)
 
-        if (itr%self.p['plot_rate']==0) or save_all:
-            self.plot_metrics()
-            self.plot_obj(archive)
-            self.plot_pulses(emitter)
+    def log_phases(self):
+        ''' Writes the seconds spent in each phase since the last call '''
+        if self.timings is None: return
+        seconds = self.timer.pop()
+        self.timings.append([self.metrics.total_evals, *seconds.values()])
+
+    def save_state(self, opt, itr, non_logging_time):
+        ''' Saves everything needed to resume the run after iteration itr '''
+        start = self.timer.start()
+        state = {'itr': itr, 'non_logging_time': non_logging_time,
+                 'archive': opt.archive.get_state(),
+                 'emitters': [e.get_state() for e in opt.emitters],
+                 'rng': {'numpy': np.random.get_state(legacy=False),
+                         'python': random.getstate()},
+                 'logger': {'n_rows': self.metrics.n_rows,
+                            'pulse_seen': self.pulse_seen,
+                            # this iteration's row is written after the state
+                            'timing_rows': (None if self.timings is None
+                                            else self.timings.n_rows + 1)}}
+        save_state(self.state_dir, state)
+        self.timer.stop('save', start)
 
-        if (itr%self.p['save_rate']==0) or save_all:
-            self.save_archive(archive, itr=itr)
-            self.save_pulse(emitter)
+    def load_state(self):
+        ''' State saved by the run being resumed (None if not resuming), logs
+        written after it are dropped '''
+        if not self.resuming:
+            return None
+        state = load_state(self.state_dir)
+        if state is None:
+            return None
+        print(f"Resuming from iteration {state['itr']}")
+        self.metrics.truncate(state['logger']['n_rows'])
+        self.pulse_seen = state['logger']['pulse_seen']
+        timing_rows = state['logger'].get('timing_rows')
+        if self.timings is not None and timing_rows is not None:
+            self.timings.truncate(timing_rows)
+        self.checkpoints.resume(state['itr'])
+        return state
 
-    def save_pulse(self, emitter):        
-        pulses = [e.pulse[1:,:] for e in emitter] # skip 0
-        if np.sum(np.stack(pulses)) == 0: return # no pulse data for emitters
+    def save_pulse(self, pulses):
+        if not any(pulse.any() for pulse in pulses): return # no pulse data for emitters
         with open(self.log_dir / 'emitter_pulse.pkl', 'wb') as f:
             pickle.dump(pulses, f)         
 
-    def plot_pulses(self, emitter):
-        # - Prep Data
-        pulses = [e.pulse[1:,:] for e in emitter] # skip 0th
-        if np.sum(np.stack(pulses)) == 0: return # no pulse data for emitters
+    def plot_pulses(self, pulses):
+        if not any(pulse.any() for pulse in pulses): return # no pulse data for emitters
         fig, ax = plot_pulse(pulses, self.p)     
         fname = str(self.log_dir / "PULSE_emitter.png")
         plt.savefig(fname,bbox_inches='tight')
         plt.clf(); plt.close()
 
-    def archive_to_numpy(self, archive):
-        """Only works for grid archives"""
+    def archive_to_numpy(self, archive, keys=('fit', 'desc', 'x', 'meta')):
+        """Grid archive as arrays in the shape of the grid, with nan in empty
+        bins. Only the arrays named in keys are built. Only works for grid
+        archives."""
         if not hasattr(archive, 'boundaries'):
             return {}
-        grid_res = [len(a)-1 for a in archive.boundaries]
-        n_beh    = archive._behavior_dim        
-
-        if archive.use_objects:
-            genome_archive = np.full(np.r_[grid_res, 1], np.nan, dtype=object)
-        else:
-            genome_archive = np.full(np.r_[grid_res, self.p['n_params']], np.nan)
-        fit_archive    = np.full(np.r_[grid_res], np.nan)
-        desc_archive   = np.full(np.r_[grid_res, n_beh], np.nan)
-        meta_archive   = np.full(np.r_[grid_res, 1], np.nan, dtype=object)
-
-        for elite in archive:
-            fit_archive   [elite.idx[0], elite.idx[1]]   = elite.obj
-            desc_archive  [elite.idx[0], elite.idx[1],:] = elite.beh
-            genome_archive[elite.idx[0], elite.idx[1],:] = elite.sol
-            meta_archive  [elite.idx[0], elite.idx[1],:] = [elite.meta]
-
-        archive_dict = {'fit': fit_archive,    'desc': desc_archive, 
-                        'x'  : genome_archive, 'meta': meta_archive}
+        occupied = archive._occupied
+        empty    = ~occupied
+        archive_dict = {}
+        if 'fit' in keys:
+            archive_dict['fit'] = np.where(occupied, archive._objective_values,
+                                           np.nan)
+        if 'desc' in keys:
+            desc = archive._behavior_values.astype(float)
+            desc[empty] = np.nan
+            archive_dict['desc'] = desc
+        if 'x' in keys:
+            genomes = np.full(archive._solutions.shape, np.nan,
+                              dtype=archive._solutions.dtype)
+            genomes[occupied] = archive._solutions[occupied]
+            archive_dict['x'] = genomes
+        if 'meta' in keys:
+            meta = np.full((*occupied.shape, 1), np.nan, dtype=object)
+            meta[occupied, 0] = archive._metadata[occupied]
+            archive_dict['meta'] = meta
         return archive_dict
         
-    def save_archive(self, archive, itr=''):  
-        ''' Saves archive as a set of numpy files'''
-        outdir = self.archive_dir
-        if hasattr(archive, 'boundaries'):
-            archive_dict = self.archive_to_numpy(archive)
-            for key, value in archive_dict.items():
-                np.save(outdir / f'{key}_{itr}.npy', value)
-                np.save(outdir / f'_{key}.npy', value)
-        else:
-            archive_pandas = archive.as_pandas(include_metadata=True)
-            archive_pandas.to_pickle(outdir / f'archive_{itr}.pd')
-            archive_pandas.to_pickle(outdir / f'_archive.pd')
+    def collect_archive(self, archive, itr):
+        ''' Checkpoint of the bins changed since the last save, written with
+        ArchiveCheckpoints.write and read back with
+        bbq.logging.checkpoint.load_archive '''
+        archive.flush()
+        return self.checkpoints.collect(archive, itr, archive.pop_changes())
 
     def update_metrics(self, archive, emitter, itr):
-        ''' Adds current iterations metrics to running record '''        
-        fitness = [archive.stats.obj_mean, np.nanmax(archive._objective_values)]
-        pulses = [e.pulse[1:,:] for e in emitter]
-        combined_pulse = np.sum(pulses,axis=0)
-        itr_evals = np.sum(combined_pulse[-1])
-        imp_ratio = np.sum(combined_pulse[-1][1:])/itr_evals
-        total_evals = self.metrics["Archive Size"]["itrs"][-1]+itr_evals
-
-        self.metrics["Archive Size"]["itrs"].append(total_evals)
-        self.metrics["Archive Size"]["vals"].append(archive.stats.num_elites)
-        self.metrics["Fitness"]["itrs"].append(total_evals)
-        self.metrics["Fitness"]["vals"].append(fitness)      
-        self.metrics["QD Score"]["itrs"].append(total_evals)
-        self.metrics["QD Score"]["vals"].append(archive.stats.qd_score)   
-        self.metrics["Improvement Ratio"]["itrs"].append(total_evals)
-        self.metrics["Improvement Ratio"]["vals"].append(imp_ratio)
-
-    def print_metrics(self, archive, itr, eval_per_iter, time):
+        ''' Adds current iterations metrics to running record. Only running
+        totals are read, so this does not grow with the run or archive. '''
+        obj_max = archive.stats.obj_max # kept up to date by every insert
+        fitness = [archive.stats.obj_mean,
+                   np.nan if obj_max is None else obj_max]
+        itr_pulse = self.new_pulse(emitter)
+        itr_evals = int(np.sum(itr_pulse))
+        if itr_evals == 0: return # nothing new since last update, e.g. final log
+        imp_ratio = np.sum(itr_pulse[1:])/itr_evals
+        total_evals = self.metrics.total_evals+itr_evals
+
+        # Evaluations | Filled Bins | Mean, Max Fitness | QD Score | Improvement
+        self.metrics.append([total_evals, archive.stats.num_elites, *fitness,
+                             archive.stats.qd_score, imp_ratio])
+
+    def new_pulse(self, emitter):
+        ''' Combined pulse of all emitter batches told since the last call '''
+        totals = [e.pulse_history.totals.copy() for e in emitter]
+        seen = self.pulse_seen or [0]*len(emitter)
+        itr_pulse = np.zeros(3, dtype=int)
+        for total, total_seen in zip(totals, seen):
+            itr_pulse += total - total_seen
+        self.pulse_seen = totals
+        return itr_pulse
+
+    def print_metrics(self, archive, itr, eval_per_iter, time, cache=None):
         ''' Print metrics to command line '''    
-        qd = np.array(self.metrics['QD Score']['vals'][-1])
-        imp_ratio = self.metrics["Improvement Ratio"]["vals"][-1]
+        qd = self.metrics.last['QD Score']
+        imp_ratio = self.metrics.last['Improvement']
         print(f"Iter: {str(itr).rjust(3, '0')}" \
             +f" | Eval: {itr*eval_per_iter}" \
             +f" | Size: {archive.stats.num_elites}" \
             +f" | QD: {qd:E}" \
             +f" | Imp Ratio: {imp_ratio:.2f}" \
-            +f" | Time/Itr: {format_timespan(time)}")         
+            +f" | Time/Itr: {format_timespan(time)}" \
+            +self.cache_text(cache) \
+            +self.phase_text())
+
+    def cache_text(self, cache):
+        ''' Hits and misses of the evaluation cache, for the progress line '''
+        if cache is None:
+            return ""
+        return f" | Cache: {cache.hits} hits, {cache.misses} misses"
+
+    def phase_text(self):
+        ''' Seconds per phase so far this generation, for the progress line '''
+        phases = [f"{phase} {format_seconds(seconds)}"
+                  for phase, seconds in self.timer.seconds.items() if seconds > 0]
+        return f" | {', '.join(phases)}" if phases else ""
 
-    def plot_metrics(self):
-        ''' Line plot of recorded metrics ''' 
-        plot_stats(self.metrics, self.p, vertical=True)
+    def plot_metrics(self, n_rows=None):
+        ''' Line plot of recorded metrics, the first n_rows generations '''
+        plot_stats(self.metrics.to_dict(n_rows), self.p, vertical=True)
         fname = str(self.log_dir / "LINE_Metrics.png")
         plt.savefig(fname,bbox_inches='tight')
         plt.clf(); plt.close()
 
     def plot_obj(self, archive):
         # TODO: clean up to be universal for archive types
-        archive_dict = self.archive_to_numpy(archive)
+        archive_dict = self.archive_to_numpy(archive, keys=('fit',))
         fig,ax = plt.subplots(figsize=(4,4),dpi=150)
         if (archive_dict):
             ax = view_map(archive_dict['fit'], self.p['archive'], ax=ax)
-        else: # if it is a CVT archive, use pyribs default for now:
+        elif hasattr(archive, '_centroids'): # CVT, use pyribs default for now:
             cvt_archive_heatmap(archive, ax=ax, cmap='YlGnBu')
+        else: # sparse grid, too many bins to draw
+            occupied = archive._occupied
+            ax = view_elites(archive._behavior_values[occupied],
+                             archive._objective_values[occupied],
+                             self.p['archive'], ax=ax)
         fig.savefig(str(self.log_dir / f"MAP_Fitness.png"))
         plt.clf(); plt.close()
 
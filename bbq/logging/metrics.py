@@ -0,0 +1,112 @@
+""" Append-only binary log of per generation metrics
+
+A run writes `metrics_header.json` once and then appends one fixed size row of
+float64 values per generation to `metrics.bin`. Appending costs the same at
+any run length, and the file can be read while the run is still writing it:
+readers memory map the complete rows that are there. Other per generation
+logs, such as the phase timings of `bbq.logging.timing`, are written the same
+way under their own `name`.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+
+# Metric name -> labels of its columns
+METRICS = {"Archive Size"     : ['Filled Bins'],
+           "Fitness"          : ['Mean Fitness', 'Max Fitness'],
+           "QD Score"         : ['QD Score'],
+           "Improvement Ratio": ['Improvement']}
+ZERO_START = ["Archive Size"] # plotted from 0 evaluations
+DTYPE = '<f8'
+
+
+class MetricsLog():
+    """ Writes metrics rows: number of evaluations followed by one column per
+    label in `metrics`, to `<name>.bin`. With `resume` the rows already in
+    `log_dir` are kept.
+    """
+    def __init__(self, log_dir, metrics=METRICS, resume=False, name='metrics',
+                 zero_start=ZERO_START):
+        log_dir = Path(log_dir)
+        self.columns = ['Evaluations'] + [l for ls in metrics.values() for l in ls]
+        header = {'columns': self.columns, 'dtype': DTYPE,
+                  'metrics': metrics, 'zero_start': zero_start}
+        with (log_dir / f'{name}_header.json').open('w') as file:
+            json.dump(header, file, indent=2)
+        self.log_dir = log_dir
+        self.name = name
+        path = log_dir / f'{name}.bin'
+        self.file = path.open('r+b' if resume and path.exists() else 'wb')
+        self.row_bytes = len(self.columns) * np.dtype(DTYPE).itemsize
+        self.truncate(path.stat().st_size // self.row_bytes)
+
+    @property
+    def total_evals(self):
+        return int(self.last['Evaluations'])
+
+    def append(self, row):
+        """ Writes one row, values in the order of `columns` """
+        row = np.asarray(row, dtype=DTYPE)
+        self.file.write(row.tobytes())
+        self.file.flush()
+        self.last = dict(zip(self.columns, row.tolist()))
+        self.n_rows += 1
+
+    def truncate(self, n_rows):
+        """ Keeps the first n_rows rows and appends after them """
+        self.file.truncate(n_rows * self.row_bytes)
+        self.file.seek(n_rows * self.row_bytes)
+        self.n_rows = n_rows
+        _, data = read_metrics(self.log_dir, n_rows, self.name)
+        last = data[-1].tolist() if n_rows > 0 else [0.0] * len(self.columns)
+        self.last = dict(zip(self.columns, last))
+
+    def to_dict(self, n_rows=None):
+        """ Metrics written so far, see `load_metrics` """
+        n_rows = self.n_rows if n_rows is None else n_rows
+        return load_metrics(self.log_dir, n_rows, self.name)
+
+    def close(self):
+        self.file.close()
+
+
+def read_metrics(folder, n_rows=None, name='metrics'):
+    """ Header and a read-only memory map of the complete rows in a metrics
+    log, at most `n_rows` of them """
+    folder = Path(folder)
+    with (folder / f'{name}_header.json').open() as file:
+        header = json.load(file)
+    dtype = np.dtype(header['dtype'])
+    n_cols = len(header['columns'])
+    path = folder / f'{name}.bin'
+    n = path.stat().st_size // (dtype.itemsize * n_cols)
+    if n_rows is not None:
+        n = min(n, n_rows)
+    if n == 0: # empty files cannot be memory mapped
+        return header, np.zeros((0, n_cols), dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', shape=(n, n_cols))
+
+
+def load_metrics(folder, n_rows=None, name='metrics'):
+    """ Metrics of a run as {name: {'itrs', 'vals', 'label'}}, the layout of
+    the old `metrics.json`, which is loaded instead for runs without a
+    metrics log. Columns are views into the memory map. """
+    folder = Path(folder)
+    if not (folder / f'{name}_header.json').exists():
+        with (folder / f'{name}.json').open() as file:
+            return json.load(file)
+
+    header, data = read_metrics(folder, n_rows, name)
+    col = {c: i for i, c in enumerate(header['columns'])}
+    metrics = {}
+    for metric, labels in header['metrics'].items():
+        itrs = data[:, 0]
+        if len(labels) == 1:
+            vals = data[:, col[labels[0]]]
+        else:
+            vals = data[:, [col[l] for l in labels]]
+        if metric in header['zero_start']:
+            itrs, vals = np.r_[0, itrs], np.r_[0, vals]
+        metrics[metric] = {'itrs': itrs, 'vals': vals, 'label': labels}
+    return metrics
@@ -3,6 +3,7 @@ from os.path import isfile, join
 import json
 import numpy as np
 from matplotlib import pyplot as plt
+from bbq.logging.metrics import load_metrics
 
 def load_json(fname):
     with open(fname) as json_file:
@@ -14,17 +15,16 @@ def collect_stats(folder, stat_key):
     rep_folders = [f for f in listdir(folder) if not isfile(join(folder, f))]
     val_list = []
     for rep in rep_folders:
-        fname = f"{folder}{rep}/metrics.json"
-        tmp = load_json(fname)
+        tmp = load_metrics(f"{folder}{rep}") # memory mapped
         if stat_key == "Mean Fitness":
-            val_list.append(np.array(tmp['Fitness']['vals'])[:,0])
-            itr_array = np.array(tmp['Fitness']['itrs'])
+            val_list.append(np.asarray(tmp['Fitness']['vals'])[:,0])
+            itr_array = np.asarray(tmp['Fitness']['itrs'])
         elif stat_key == "Max Fitness":
-            val_list.append(np.array(tmp['Fitness']['vals'])[:,1])            
-            itr_array = np.array(tmp['Fitness']['itrs'])
+            val_list.append(np.asarray(tmp['Fitness']['vals'])[:,1])            
+            itr_array = np.asarray(tmp['Fitness']['itrs'])
         else:
             val_list.append(tmp[stat_key]['vals'])   
-            itr_array = np.array(tmp[stat_key]['itrs'])
+            itr_array = np.asarray(tmp[stat_key]['itrs'])
 
     val_array = np.stack(val_list)
     return val_array, itr_array
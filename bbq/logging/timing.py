@@ -0,0 +1,111 @@
+""" Per generation timing of the phases of a run
+
+With `time_phases: True` in the config, the MAP-Elites loops time each phase
+of every generation and the logger writes the seconds spent in them as one
+row per generation to `timings.bin` (read with `load_metrics(folder,
+name='timings')`), and adds them to the progress line:
+
+    ask         - emitters creating new solutions
+    eval-submit - handing solutions to the evaluator's workers
+    eval-wait   - waiting for their results, or evaluating them in the main
+                  process with the serial evaluator
+    tell-<i>    - emitter i adding its results to the archive
+    log         - updating and printing metrics, handing plots and saves to
+                  the log worker with `async_logs`
+    plot        - plotting, unless done by the log worker
+    save        - saving the archive and the state of the run, unless done by
+                  the log worker
+
+Domains can time their own steps by listing them in `timed_phases` and
+reporting them to `self.timer` (see `BbqDomain`). Only the main thread of the
+main process records: time spent on the evaluator's workers, threads or
+processes, shows only as `eval-wait`.
+
+A disabled timer is a `NullTimer`, whose calls do nothing.
+"""
+import threading
+from time import perf_counter
+
+PHASES = ['ask', 'eval-submit', 'eval-wait', 'log', 'plot', 'save']
+
+
+class PhaseTimer():
+    """ Seconds spent in each phase since the last `pop`, recorded from the
+    thread that created the timer. Copies sent to worker processes do nothing. """
+    enabled = True
+
+    def __init__(self, phases):
+        self.phases = list(phases)
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        self.thread = threading.get_ident()
+
+    def __reduce__(self):
+        return NullTimer, ()
+
+    def start(self):
+        return perf_counter()
+
+    def stop(self, phase, start):
+        """ Adds the time since `start` to `phase`, returns the current time
+        to start the next phase with """
+        now = perf_counter()
+        if threading.get_ident() == self.thread:
+            self.seconds[phase] += now - start
+        return now
+
+    def add(self, phase, seconds):
+        """ Adds seconds timed elsewhere to `phase` """
+        if threading.get_ident() == self.thread:
+            self.seconds[phase] += seconds
+
+    def pop(self):
+        """ Seconds per phase so far, starts counting again from zero """
+        seconds = self.seconds
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        return seconds
+
+
+class NullTimer():
+    """ Timer that does nothing, used when timing is disabled """
+    enabled = False
+    phases = []
+    seconds = {}
+
+    def start(self):
+        return 0.0
+
+    def stop(self, phase, start):
+        return 0.0
+
+    def add(self, phase, seconds):
+        pass
+
+    def pop(self):
+        return {}
+
+
+NULL_TIMER = NullTimer()
+
+
+def init_timer(p, domain=None):
+    """ Timer of the phases of a run, with a tell phase per emitter and the
+    phases the domain reports. A `NullTimer` unless `time_phases` is set. """
+    if not p.get('time_phases', False):
+        return NULL_TIMER
+    tells = [f'tell-{i}' for i in range(len(p['emitters']))]
+    domain_phases = list(getattr(domain, 'timed_phases', ()))
+    evaluator = p.get('evaluator') or ('serial' if p.get('n_workers', 1) == 1
+                                       else 'dask') # as in init_evaluator
+    if domain_phases and evaluator != 'serial':
+        print(f"[!] {', '.join(domain_phases)} only timed in the main thread, "
+              f"time on the {evaluator} workers shows as eval-wait")
+    return PhaseTimer(PHASES[:3] + tells + PHASES[3:] + domain_phases)
+
+
+def format_seconds(seconds):
+    """ Short text of a duration, e.g. '12.3ms' """
+    if seconds >= 1:
+        return f'{seconds:.2f}s'
+    if seconds >= 1e-3:
+        return f'{1e3*seconds:.1f}ms'
+    return f'{1e6*seconds:.0f}us'
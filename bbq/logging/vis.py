@@ -225,6 +225,22 @@ def view_map(Z, p, ax=None, bin_ticks=False):
                 
     return ax
 
+def view_elites(desc, fit, p, ax=None):
+    """ Elites as points in the first two behavior dimensions, for archives
+    without a grid to draw, e.g. sparse grids """
+    if ax is None:
+        fig,ax = plt.subplots(figsize=(4,4),dpi=150)
+    order = np.argsort(fit) # best on top
+    sc = ax.scatter(desc[order,0], desc[order,1], c=fit[order], s=2,
+                    cmap='YlGnBu')
+    divider = make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="5%", pad=0.1)
+    plt.colorbar(sc, cax=cax)
+    ax.set(xlim=p['desc_bounds'][0], ylim=p['desc_bounds'][1],
+           xlabel=p['desc_labels'][0], ylabel=p['desc_labels'][1])
+    ax.set_title(p['fitness_labels'][0] if 'fitness_labels' in p else "Fitness")
+    return ax
+
 def view_by_bin(coord, meta, visualize, ax, inset_coord=[1.5,0,1,1]):
     solution = meta[coord[::-1]][0]
     axins = ax.inset_axes(inset_coord)
@@ -286,7 +302,7 @@ def view_solutions(fit, meta, visualize, p, plot_per_side=3, bin_list=None):
 def norm_pulse(pulse):
     n_children  = np.sum(pulse,axis=1)
     norm_factor = np.tile(n_children,(3,1)).T
-    pulse /= norm_factor
+    pulse = pulse / norm_factor
     return pulse
 
 def moving_average(y, window_width = 5):
@@ -297,7 +313,7 @@ def moving_average(y, window_width = 5):
 
 def max_bins(p):
     archive = p['archive']
-    if archive['type'] == "Grid":
+    if archive['type'] in ("Grid", "SparseGrid"):
         return np.prod(archive['grid_res'])
     if archive['type'] == "CVT":
         return archive['n_bins']
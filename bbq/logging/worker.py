@@ -0,0 +1,46 @@
+""" Background thread for plotting and saving logs off the search loop """
+import queue
+import threading
+import traceback
+
+import matplotlib
+
+
+class LogWorker():
+    """ Runs logging jobs in order on a background thread.
+
+    At most `max_pending` jobs wait in the queue. When it is full `submit`
+    blocks until the worker has caught up, so a slow logger holds at most
+    `max_pending` snapshots in memory instead of falling behind without bound.
+    A failing job is reported and does not stop the search, the first error
+    is raised again on `close`.
+    """
+    def __init__(self, max_pending=1):
+        # pyplot is only safe off the main thread with a non-GUI backend
+        matplotlib.use('Agg')
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, job, *args):
+        self.queue.put((job, args))
+
+    def close(self):
+        """ Waits for queued jobs to finish and stops the thread """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            job, args = item
+            try:
+                job(*args)
+            except Exception as e:
+                traceback.print_exc()
+                self.error = self.error or e
@@ -1,37 +1,310 @@
 """ General MAP-Elites flow using BBQ 
 """
+import random
 import time
+from collections import deque
+import numpy as np
 from ribs.optimizers import Optimizer
 from bbq.archives._init_archive import init_archive
+from bbq.domains._cache import SubmittedBatch, init_cache
 from bbq.emitters._init_emitter import init_emitter, emitter_lookup
+from bbq.logging.timing import init_timer
 
 
 def map_elites(d, p, logger, emitter_lookup=emitter_lookup):
     # - Setup -----------------------------------------------------------------#
-    # : Initial solutions
-    start_xx = d.init(p['n_init'])
+    timer = init_timer(p, d)       # phase timings, see bbq.logging.timing
+    d.timer = timer
+    logger.set_timer(timer)
+    state = logger.load_state()    # saved state when resuming a run
     evaluator = d.prep_eval(**p)   # initialize evaluation stack
-    objs, descs, metas = d.batch_eval(start_xx, evaluator)
+    d.cache = init_cache(p, d)     # after prep_eval, workers need no copy
+    init = None
+    if state is None: # : Initial solutions, see InitStream
+        init = InitStream(d, p, evaluator)
+        start_xx, objs, descs, metas = init.first()
+    else:             # : Elites of the resumed run stand in for them
+        start_xx = saved_elites(state)
 
     # : Setup emitters and archive
-    archive = init_archive(p)
+    archive = init_archive(p, storage_dir=logger.log_dir/'storage')
     emitter = init_emitter(p, archive, start_xx, emitter_lookup=emitter_lookup)
     opt = Optimizer(archive, emitter)                      
-    archive.add_batch(start_xx, objs, descs, metas)
+    if state is None:
+        archive.add_batch(start_xx, objs, descs, metas)
+        # : Emitters start once the archive holds `init_elites` elites
+        while not init.done and archive.stats.num_elites < p.get('init_elites', 1):
+            add_init(archive, init, wait=True)
+        first_itr, non_logging_time = 1, 0.0
+    else:
+        first_itr, non_logging_time = restore(opt, state)
+    timer.pop() # initial solutions are not part of a generation
 
     # - Main Loop -------------------------------------------------------------#
-    non_logging_time = 0.0
-    for itr in range(1, p['n_gens']+1):
+    if p.get('async_evals', 0) > 0 and evaluator is not None:
+        itr, non_logging_time = steady_state(d, p, opt, evaluator, logger,
+                                             first_itr, non_logging_time, init)
+        add_init(archive, init, wait=True, rest=True)
+        logger.final_log(opt, d, itr, non_logging_time)
+        evaluator.close()
+        if d.cache is not None:
+            d.cache.save()
+        return archive
+
+    itr = first_itr - 1 # stays if a resumed run was already finished
+    for itr in range(first_itr, p['n_gens']+1):
         itr_start = time.time()       
         # - MAP-ELITES --------------------------------------------------------#
+        start = timer.start()
         inds = opt.ask()                                # Create new solutions
+        timer.stop('ask', start)
         objs, bcs, meta = d.batch_eval(inds, evaluator) # Evaluate solutions
-        opt.tell(objs, bcs, meta)                       # Add to archive
+        if timer.enabled:
+            timed_tell(opt, objs, bcs, meta, timer)     # Add to archive
+        else:
+            opt.tell(objs, bcs, meta)
+        add_init(archive, init) # initial solutions still coming in
 
         # - Logging -----------------------------------------------------------#
         itr_time = time.time() - itr_start
         non_logging_time += itr_time
         logger.log_metrics(opt, d, itr, itr_time)
+        if itr%p['save_rate'] == 0:
+            logger.save_state(opt, itr, non_logging_time)
+        logger.print_progress(opt, d, itr, itr_time)
+        logger.log_phases()
 
+    add_init(archive, init, wait=True, rest=True)
     logger.final_log(opt, d, itr, non_logging_time)
+    if evaluator is not None:
+        evaluator.close()
+    if d.cache is not None:
+        d.cache.save()
     return archive
+
+
+def steady_state(d, p, opt, evaluator, logger, first_itr=1,
+                 non_logging_time=0.0, init=None):
+    """ Asynchronous MAP-Elites: keeps `async_evals` evaluations in flight
+
+    Emitters are asked for batches in turn whenever fewer than `async_evals`
+    individuals are being evaluated, so the workers never wait on the slowest
+    individual of a generation or on archive updates and logging. A batch is
+    told to the emitter that asked for it as soon as all of its individuals
+    are back. Only emitters that keep no state between ask and tell
+    (`ask_ahead`, e.g. Gauss, Line, Object) have several batches in flight,
+    the others (CMA-ES) are skipped until their batch is told. Every `len(emitters)` told batches count as one iteration for
+    logging, and the run stops after `n_gens` iterations worth of batches.
+    Saved states do not include the batches in flight, a resumed run asks for
+    them again. Initial solutions still being evaluated (`init`) are added
+    whenever a batch is told. Batches go through the evaluation cache, one
+    found entirely in it is told before asking for more.
+    """
+    emitters = opt.emitters
+    timer = logger.timer
+    n_batches = p['n_gens'] * len(emitters)
+    stream = evaluator.stream()
+    owner = {}   # future -> (batch id, slice of submitted individuals)
+    batches = {} # batch id -> (emitter index, solutions, SubmittedBatch)
+    finished = deque() # ids of batches with all results in
+    n_asked = n_told = (first_itr-1) * len(emitters)
+    n_running = 0
+    asked = [first_itr-1] * len(emitters) # batches asked per emitter
+    in_flight = [0] * len(emitters)       # batches not told yet per emitter
+    turn = 0 # emitter to ask next
+
+    itr = first_itr - 1
+    itr_start = time.time()
+    while n_told < n_batches:
+        # - Top up queue ------------------------------------------------------#
+        while n_asked < n_batches and n_running < p['async_evals']:
+            i = next_emitter(emitters, turn, asked, in_flight, p['n_gens'])
+            if i is None: # the ones left wait for their batch to be told
+                break
+            turn = (i + 1) % len(emitters)
+            asked[i] += 1
+            in_flight[i] += 1
+            start = timer.start()
+            sols = emitters[i].ask()
+            start = timer.stop('ask', start)
+            batch = SubmittedBatch(d, sols, evaluator)
+            batches[n_asked] = (i, sols, batch)
+            for future, part in batch.futures:
+                owner[future] = (n_asked, part)
+                stream.add(future)
+            timer.stop('eval-submit', start)
+            n_asked += 1
+            n_running += batch.left
+            if batch.done: # all in the cache, tell it first
+                finished.append(n_asked - 1)
+                break
+
+        # - Collect finished evaluations --------------------------------------#
+        if not finished:
+            start = timer.start()
+            future = next(stream)
+            batch_id, part = owner.pop(future)
+            results = future.result()
+            timer.stop('eval-wait', start)
+            batches[batch_id][2].set(part, results)
+            n_running -= len(results)
+            if not batches[batch_id][2].done:
+                continue
+            finished.append(batch_id)
+
+        # - Tell emitter that asked for the batch -----------------------------#
+        i, sols, batch = batches.pop(finished.popleft())
+        objs, descs, metas = batch.collect()
+        start = timer.start()
+        emitters[i].tell(sols, objs, descs, metas)
+        timer.stop(f'tell-{i}', start)
+        in_flight[i] -= 1
+        add_init(opt.archive, init)
+        n_told += 1
+
+        # - Logging -----------------------------------------------------------#
+        if n_told % len(emitters) == 0:
+            itr += 1
+            itr_time = time.time() - itr_start
+            non_logging_time += itr_time
+            logger.log_metrics(opt, d, itr, itr_time)
+            if itr%p['save_rate'] == 0:
+                logger.save_state(opt, itr, non_logging_time)
+            logger.print_progress(opt, d, itr, itr_time)
+            logger.log_phases()
+            itr_start = time.time()
+
+    return itr, non_logging_time
+
+
+def next_emitter(emitters, turn, asked, in_flight, n_gens):
+    """ First emitter from `turn` on, in turn, with batches left to ask that
+    may be asked now: emitters without `ask_ahead` only once their batch in
+    flight is told. None if there is none. """
+    for k in range(len(emitters)):
+        i = (turn + k) % len(emitters)
+        if asked[i] < n_gens and (in_flight[i] == 0 or
+                                  getattr(emitters[i], 'ask_ahead', False)):
+            return i
+    return None
+
+
+class InitStream():
+    """ Initial solutions of `d.init_chunks`, evaluated a chunk at a time
+
+    The first chunk is evaluated right away, to start the emitters from. With
+    a parallel evaluator (threads, processes, dask) the next `max_pending`
+    chunks are then evaluated on its workers alongside the search. The serial
+    evaluator would evaluate submitted chunks on the spot, so it evaluates
+    one chunk, as one batch, each time chunks are asked for (once per
+    generation). Only the chunks being evaluated are held in memory. A run
+    resumed from a state saved before all chunks were added does not
+    evaluate the rest.
+    """
+    def __init__(self, d, p, evaluator, max_pending=2):
+        self.d = d
+        self.evaluator = evaluator
+        self.parallel = evaluator.parallel
+        self.max_pending = max_pending
+        self.chunks = d.init_chunks(p['n_init'], p.get('init_chunk'))
+        self.pending = deque() # (solutions, SubmittedBatch) in order
+        self.exhausted = False
+
+    @property
+    def done(self):
+        return self.exhausted and not self.pending
+
+    def first(self):
+        """ First chunk and its objs, descs, metas """
+        xx = self._next_chunk()
+        results = self.d.batch_eval(xx, self.evaluator)
+        self._fill()
+        return (xx, *results)
+
+    def ready(self, wait=False):
+        """ Evaluated chunks as (solutions, objs, descs, metas), the ones
+        already finished, waiting for one if `wait`. With a serial evaluator
+        the next chunk. """
+        if not self.parallel:
+            xx = self._next_chunk()
+            if xx is None:
+                return []
+            return [(xx, *self.d.batch_eval(xx, self.evaluator))]
+        chunks = []
+        while self.pending:
+            xx, batch = self.pending[0]
+            if not (wait and not chunks) and not all(f.done() for f, _ in batch.futures):
+                break
+            self.pending.popleft()
+            for future, part in batch.futures:
+                batch.set(part, future.result())
+            chunks.append((xx, *batch.collect()))
+            self._fill()
+        return chunks
+
+    def _next_chunk(self):
+        for xx in self.chunks:
+            if len(xx) > 0:
+                return xx
+        self.exhausted = True
+        return None
+
+    def _fill(self):
+        """ Submits chunks until `max_pending` are being evaluated """
+        if not self.parallel:
+            return
+        while len(self.pending) < self.max_pending:
+            xx = self._next_chunk()
+            if xx is None:
+                return
+            self.pending.append((xx, SubmittedBatch(self.d, xx, self.evaluator)))
+
+
+def add_init(archive, init, wait=False, rest=False):
+    """ Adds the initial solutions evaluated so far to the archive, or
+    waits for all that are left with `rest` """
+    while init is not None and not init.done:
+        for xx, objs, descs, metas in init.ready(wait):
+            archive.add_batch(xx, objs, descs, metas)
+        if not rest:
+            return
+
+
+def timed_tell(opt, objs, descs, metas, timer):
+    """ `opt.tell`, timing the tell of each emitter as phase 'tell-<i>' """
+    emitters = opt.emitters
+    for i, e in enumerate(emitters): # shadows the method until told
+        e.tell = timed(e.tell, f'tell-{i}', timer)
+    try:
+        opt.tell(objs, descs, metas)
+    finally:
+        for e in emitters:
+            del e.tell
+
+
+def timed(function, phase, timer):
+    """ `function`, adding the time of each call to `phase` """
+    def call(*args, **kwargs):
+        start = timer.start()
+        result = function(*args, **kwargs)
+        timer.stop(phase, start)
+        return result
+    return call
+
+
+def saved_elites(state):
+    """ Solutions in the archive of a saved state """
+    xx = state['archive']['solutions'] # occupied bins only
+    return xx[:, 0] if xx.dtype == object else xx
+
+
+def restore(opt, state):
+    """ Restores archive, emitters and global random number generators from a
+    saved state, returns the next iteration and the time spent so far """
+    opt.archive.set_state(state['archive'])
+    for e, e_state in zip(opt.emitters, state['emitters']):
+        e.set_state(e_state)
+    np.random.set_state(state['rng']['numpy'])
+    version, internal, gauss = state['rng']['python']
+    random.setstate((version, tuple(internal), gauss))
+    return state['itr'] + 1, state['non_logging_time']
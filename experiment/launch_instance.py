@@ -1,10 +1,10 @@
-from bbq.logging.logger import RibsLogger
-from bbq.map_elites import map_elites
+from bbq.experiment.runner import run_experiments
 from bbq.examples.planar_arm import PlanarArm  
-from bbq.utils import load_config
 import fire
 
-def launch_instance(id=2, rep=1):
+def launch_instance(id=None, reps=5, cores=None):
+    """ Runs the emitter comparison on the planar arm, `reps` replicates of
+    every emitter (or only emitter `id`) on the local cores """
     # Experiment Setup
     config_dir = '../config/'
     base = 'd_arm_grid.yaml'
@@ -15,11 +15,10 @@ def launch_instance(id=2, rep=1):
     emmiter = ['e_gauss.yaml', 'e_line.yaml', 'e_cmame.yaml', 'e_mixed.yaml']
 
     # Run Experiments
-    p = load_config([config_dir+base, config_dir+exp, config_dir+emmiter[id]])
-    p['exp_name'] = exp_name[id]
-    logger = RibsLogger(p, rep=rep)
-    domain = PlanarArm(**p)
-    archive = map_elites(domain, p, logger)
+    ids = range(len(emmiter)) if id is None else [id]
+    configs = [[config_dir+base, config_dir+exp, config_dir+emmiter[i]] for i in ids]
+    run_experiments(PlanarArm, *configs, reps=reps, cores=cores,
+                    exp_names=[exp_name[i] for i in ids])
 
 if __name__ == '__main__':
-    fire.Fire(launch_instance)
\ No newline at end of file
+    fire.Fire(launch_instance)
@@ -1,8 +1,3 @@
 #!/bin/bash
-for id in {0..3}
-do
-    for rep in {1..5}
-    do
-    python3 launch_instance.py --id=$id --rep=$rep &
-    done
-done
\ No newline at end of file
+# All emitters x 5 replicates, scheduled over the local cores
+python3 launch_instance.py --reps=5
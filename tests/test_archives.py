@@ -0,0 +1,208 @@
+""" Batch insertion of the BBQ archives against adding one solution at a time
+"""
+import numpy as np
+import pytest
+from ribs.archives._add_status import AddStatus
+
+from bbq.archives._init_archive import archive_lookup
+
+SOLUTION_DIM = 3
+ARCHIVES = {'Grid'      : dict(grid_res=[6, 6]),
+            'CVT'       : dict(n_bins=20, custom_centroids=np.random.default_rng(
+                                   0).random((20, 2))),
+            'SparseGrid': dict(grid_res=[40, 40], init_capacity=4)}
+
+
+def make_archive(kind):
+    archive = archive_lookup[kind](desc_bounds=[[0, 1], [0, 1]], **ARCHIVES[kind])
+    archive.initialize(SOLUTION_DIM)
+    return archive
+
+
+def make_copy(archive, kind):
+    """ Independent archive holding the same elites, through get_state """
+    copy = make_archive(kind)
+    copy.set_state(archive.get_state())
+    return copy
+
+
+def contents(archive):
+    """ Everything add and add_batch write, by bin """
+    occupied = archive._occupied
+    return {'occupied': occupied.copy(),
+            'objective': archive._objective_values[occupied],
+            'behavior': archive._behavior_values[occupied],
+            'solution': archive._solutions[occupied],
+            'metadata': list(archive._metadata[occupied]),
+            'indices': sorted(archive._occupied_indices)}
+
+
+def assert_same_archive(a, b):
+    ca, cb = contents(a), contents(b)
+    for key in ca:
+        np.testing.assert_array_equal(ca[key], cb[key], err_msg=key)
+    sa, sb = a.stats, b.stats
+    assert sa.num_elites == sb.num_elites
+    assert sa.coverage == sb.coverage
+    assert sa.qd_score == pytest.approx(sb.qd_score)
+    assert sa.obj_mean == pytest.approx(sb.obj_mean)
+    assert sa.obj_max == pytest.approx(sb.obj_max)
+
+
+def add_serial(archive, xx, objs, descs, metas):
+    return np.array([archive.add(x, o, d, m)
+                     for x, o, d, m in zip(xx, objs, descs, metas)]).T
+
+
+def expected_batch(archive, objs, descs):
+    """ Statuses and values add_batch documents: the best of each bin (the
+    first on ties) is added on its own to the archive before the batch, the
+    others are NOT_ADDED and measured against what holds the bin after it """
+    status = np.full(len(objs), AddStatus.NOT_ADDED, dtype=np.int32)
+    value = np.zeros(len(objs))
+    bins = {}
+    for i, desc in enumerate(descs):
+        if not np.isnan(desc).any():
+            bins.setdefault(archive.get_index(desc), []).append(i)
+    for index, members in bins.items():
+        best = members[int(np.argmax(objs[members]))]
+        old = (archive._objective_values[index] if archive._occupied[index]
+               else np.nan)
+        for i in members:
+            value[i] = objs[i] - np.fmax(old, objs[best])
+        if np.isnan(old):
+            status[best], value[best] = AddStatus.NEW, objs[best]
+        elif objs[best] > old:
+            status[best] = AddStatus.IMPROVE_EXISTING
+            value[best] = objs[best] - old
+    return status, value
+
+
+def random_batch(rng, n, nan_rows=()):
+    xx = rng.random((n, SOLUTION_DIM))
+    objs = rng.random(n)
+    descs = rng.random((n, 2))
+    descs[list(nan_rows), 0] = np.nan
+    return xx, objs, descs, list(range(n))
+
+
+@pytest.mark.parametrize('kind', ARCHIVES)
+def test_batch_matches_serial(kind):
+    """ Several batches with duplicate bins, ties and nan behaviors end in
+    the same archive as adding their solutions one at a time """
+    rng = np.random.default_rng(1)
+    batch_archive, serial_archive = make_archive(kind), make_archive(kind)
+    for itr in range(5):
+        xx, objs, descs, metas = random_batch(rng, 60, nan_rows=(3, 17))
+        objs[10:14] = objs[9] # ties, in the same bin
+        descs[10:14] = descs[9]
+        # ties with the current elite of a bin do not replace it
+        if itr > 0:
+            elite = serial_archive._occupied_indices[0]
+            descs[20] = serial_archive._behavior_values[elite]
+            objs[20] = serial_archive._objective_values[elite]
+        metas = [(itr, m) for m in metas]
+
+        expected = expected_batch(make_copy(serial_archive, kind), objs, descs)
+        status, value = batch_archive.add_batch(xx, objs, descs, metas)
+        add_serial(serial_archive, xx, objs, descs, metas)
+
+        np.testing.assert_array_equal(status, expected[0])
+        np.testing.assert_allclose(value, expected[1])
+        assert_same_archive(batch_archive, serial_archive)
+
+
+@pytest.mark.parametrize('kind', ARCHIVES)
+def test_batch_statuses_of_distinct_bins(kind):
+    """ Without two solutions in one bin the statuses and values are the ones
+    of adding them one at a time """
+    rng = np.random.default_rng(2)
+    batch_archive, serial_archive = make_archive(kind), make_archive(kind)
+    for _ in range(3):
+        xx, objs, descs, metas = random_batch(rng, 200)
+        scratch, first = make_copy(serial_archive, kind), {}
+        for i, desc in enumerate(descs):
+            first.setdefault(scratch.get_index(desc), i)
+        keep = sorted(first.values())
+        xx, objs, descs = xx[keep], objs[keep], descs[keep]
+        metas = [metas[i] for i in keep]
+        status, value = batch_archive.add_batch(xx, objs, descs, metas)
+        serial_status, serial_value = add_serial(serial_archive, xx, objs,
+                                                 descs, metas)
+        np.testing.assert_array_equal(status, serial_status)
+        np.testing.assert_allclose(value, serial_value)
+        assert_same_archive(batch_archive, serial_archive)
+
+
+def test_batch_in_one_bin():
+    """ The best of a bin wins, the others are measured against it """
+    archive = make_archive('Grid')
+    descs = np.full((3, 2), 0.5)
+    status, value = archive.add_batch(np.zeros((3, SOLUTION_DIM)),
+                                      [1.0, 3.0, 2.0], descs)
+    np.testing.assert_array_equal(status, [AddStatus.NOT_ADDED, AddStatus.NEW,
+                                           AddStatus.NOT_ADDED])
+    np.testing.assert_allclose(value, [-2.0, 3.0, -1.0])
+    assert archive.stats.num_elites == 1
+    assert archive.stats.qd_score == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize('kind', ARCHIVES)
+def test_nan_behaviors_are_skipped(kind):
+    archive = make_archive(kind)
+    descs = np.array([[np.nan, 0.5], [0.5, np.nan]])
+    status, value = archive.add_batch(np.zeros((2, SOLUTION_DIM)), [1.0, 2.0],
+                                      descs)
+    np.testing.assert_array_equal(status, AddStatus.NOT_ADDED)
+    np.testing.assert_array_equal(value, 0.0)
+    assert len(archive) == 0
+
+
+def test_sparse_grid_matches_grid():
+    """ A sparse grid growing from 4 slots holds the elites of a dense grid
+    of the same resolution """
+    rng = np.random.default_rng(3)
+    grid = archive_lookup['Grid'](grid_res=[40, 40], desc_bounds=[[0, 1], [0, 1]])
+    grid.initialize(SOLUTION_DIM)
+    sparse = make_archive('SparseGrid')
+    for n in (3, 10, 50, 300):
+        xx, objs, descs, metas = random_batch(rng, n, nan_rows=(1,))
+        grid.add_batch(xx, objs, descs, metas)
+        sparse.add_batch(xx, objs, descs, metas)
+    capacity = sparse._storage_dims[0]
+    assert capacity >= len(sparse) > 64 and capacity & (capacity - 1) == 0
+    slots = np.arange(len(sparse.slot_bins))
+    bins = np.unravel_index(sparse.slot_bins, grid._storage_dims)
+    np.testing.assert_array_equal(grid._occupied[bins], sparse._occupied[slots])
+    np.testing.assert_array_equal(grid._objective_values[bins],
+                                  sparse._objective_values[slots])
+    np.testing.assert_array_equal(grid._solutions[bins], sparse._solutions[slots])
+    np.testing.assert_array_equal(grid._metadata[bins], sparse._metadata[slots])
+    assert not sparse._occupied[len(slots):].any()
+    assert np.isnan(sparse._objective_values[len(slots):]).all()
+    assert sparse.stats.qd_score == pytest.approx(grid.stats.qd_score)
+    # looking up an empty bin does not give it a slot
+    empty = (np.argwhere(~grid._occupied)[0] + 0.5) / 40
+    assert sparse.elite_with_behavior(empty).obj is None
+    assert len(sparse._slots) == len(slots)
+
+
+def test_sparse_grid_state_across_resize():
+    """ set_state restores a grown sparse grid into a new one with its initial
+    capacity, and both continue the same """
+    rng = np.random.default_rng(4)
+    archive = make_archive('SparseGrid')
+    archive.add_batch(*random_batch(rng, 100))
+    restored = make_archive('SparseGrid')
+    restored.set_state(archive.get_state())
+    assert restored._storage_dims == archive._storage_dims
+    np.testing.assert_array_equal(restored.slot_bins, archive.slot_bins)
+    assert restored._slots == archive._slots
+    assert_same_archive(restored, archive)
+    for n in (5, 200, 400): # doubles the storage again
+        batch = random_batch(rng, n)
+        np.testing.assert_array_equal(restored.add_batch(*batch),
+                                      archive.add_batch(*batch))
+    assert restored._storage_dims[0] > 128
+    np.testing.assert_array_equal(restored.slot_bins, archive.slot_bins)
+    assert_same_archive(restored, archive)
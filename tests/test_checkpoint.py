@@ -0,0 +1,105 @@
+""" Incremental checkpoints read back with load_archive
+"""
+import numpy as np
+import pytest
+
+from bbq.logging.checkpoint import ArchiveCheckpoints, load_archive, read_manifest
+from test_archives import ARCHIVES, make_archive, random_batch
+
+
+def dense(archive):
+    """ Layout of load_archive: arrays in the shape of the storage, nan in
+    empty bins """
+    occupied = archive._occupied
+    fit = np.where(occupied, archive._objective_values, np.nan)
+    desc = np.full(archive._behavior_values.shape, np.nan)
+    desc[occupied] = archive._behavior_values[occupied]
+    x = np.full(archive._solutions.shape, np.nan)
+    x[occupied] = archive._solutions[occupied]
+    meta = np.full((*occupied.shape, 1), np.nan, dtype=object)
+    meta[occupied, 0] = archive._metadata[occupied]
+    return {'fit': fit, 'desc': desc, 'x': x, 'meta': meta}
+
+
+def assert_same(loaded, expected):
+    """ Equal up to the storage of `expected`, sparse grids grow after it """
+    for key, value in expected.items():
+        part = loaded[key][:len(value)]
+        if key == 'meta':
+            assert [m for m in part.ravel() if m == m] == \
+                   [m for m in value.ravel() if m == m], key
+        else:
+            np.testing.assert_array_equal(part, value, err_msg=key)
+    assert np.all(np.isnan(loaded['fit'][len(expected['fit']):]))
+
+
+@pytest.mark.parametrize('kind', ARCHIVES)
+def test_round_trip(kind, tmp_path):
+    """ Every save loads back as the archive was when it was saved """
+    rng = np.random.default_rng(0)
+    archive = make_archive(kind)
+    checkpoints = ArchiveCheckpoints(tmp_path)
+    saved = {}
+    for itr in range(1, 13):
+        xx, objs, descs, _ = random_batch(rng, 8 if itr % 4 else 40)
+        metas = [f'{itr}-{i}' for i in range(len(objs))]
+        archive.add_batch(xx, objs, descs, metas)
+        if itr == 7:
+            archive.clear() # a cleared archive starts a new base
+            archive.add_batch(xx, objs, descs, metas)
+        checkpoints.save(archive, itr, archive.pop_changes())
+        saved[itr] = dense(archive)
+
+    kinds = [c['type'] for c in read_manifest(tmp_path)['checkpoints']]
+    assert kinds[0] == 'base' and 'delta' in kinds and kinds.count('base') > 1
+    assert kinds[6] == 'base'
+    for itr, expected in saved.items():
+        assert_same(load_archive(tmp_path, itr), expected)
+    assert_same(load_archive(tmp_path), saved[12])
+
+
+def test_nothing_new_is_not_saved_twice(tmp_path):
+    archive = make_archive('Grid')
+    checkpoints = ArchiveCheckpoints(tmp_path)
+    archive.add_batch(*random_batch(np.random.default_rng(0), 20))
+    checkpoints.save(archive, 5, archive.pop_changes())
+    archive.add_batch(*random_batch(np.random.default_rng(1), 1))
+    checkpoints.save(archive, 6, archive.pop_changes())
+    checkpoints.save(archive, 6, archive.pop_changes()) # e.g. the final log
+    assert len(read_manifest(tmp_path)['checkpoints']) == 2
+    with pytest.raises(ValueError):
+        load_archive(tmp_path, 4)
+
+
+def test_collected_checkpoint_is_not_changed_by_later_adds(tmp_path):
+    """ Checkpoints written on the log worker hold the archive as collected """
+    rng = np.random.default_rng(0)
+    archive = make_archive('SparseGrid')
+    checkpoints = ArchiveCheckpoints(tmp_path)
+    archive.add_batch(*random_batch(rng, 30))
+    ckpt = checkpoints.collect(archive, 1, archive.pop_changes())
+    expected = dense(archive)
+    archive.add_batch(*random_batch(rng, 200)) # grows the sparse storage
+    checkpoints.write(ckpt)
+    assert_same(load_archive(tmp_path, 1), expected)
+
+
+def test_resume_forgets_later_saves(tmp_path):
+    """ A resumed run drops saves after its state and starts with a base """
+    rng = np.random.default_rng(0)
+    archive = make_archive('Grid')
+    checkpoints = ArchiveCheckpoints(tmp_path)
+    for itr in (1, 2, 3):
+        archive.add_batch(*random_batch(rng, 5))
+        checkpoints.save(archive, itr, archive.pop_changes())
+    at_2 = load_archive(tmp_path, 2)
+
+    resumed = ArchiveCheckpoints(tmp_path)
+    resumed.resume(2)
+    archive.add_batch(*random_batch(rng, 5))
+    resumed.save(archive, 3, archive.pop_changes())
+    manifest = read_manifest(tmp_path)
+    assert [(c['itr'], c['type']) for c in manifest['checkpoints']][-2:] == \
+           [(2, 'delta'), (3, 'base')]
+    assert_same(load_archive(tmp_path, 3), dense(archive))
+    assert_same(load_archive(tmp_path, 2), at_2)
@@ -0,0 +1,78 @@
+""" Resumed runs continue exactly where the saved state left off
+"""
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+import pytest
+
+from bbq.examples.planar_arm import PlanarArm
+from bbq.examples.rastrigin import Rastrigin, Rastrigin_Obj
+from bbq.logging.checkpoint import load_archive
+from bbq.logging.logger import RibsLogger
+from bbq.logging.metrics import read_metrics
+from bbq.map_elites import map_elites
+from bbq.utils import load_config
+
+matplotlib.use('Agg')
+CONFIG = Path(__file__).parent.parent / 'config'
+RUNS = {'grid_mixed': (Rastrigin, ['d_rast.yaml', 'e_mixed.yaml'], {}),
+        'cvt_cmame' : (PlanarArm, ['d_arm.yaml', 'e_cmame.yaml'], {}),
+        'objects'   : (Rastrigin_Obj, ['d_rast_obj.yaml'], {}),
+        'sparse'    : (Rastrigin, ['d_rast.yaml', 'e_gauss.yaml'],
+                       {'archive': {'type': 'SparseGrid', 'grid_res': [100, 100],
+                                    'init_capacity': 16,
+                                    'desc_bounds': [[-2, 2], [-2, 2]],
+                                    'desc_labels': ['Param 1', 'Param 2']}})}
+ASYNC = (Rastrigin, ['d_rast.yaml', 'e_mixed.yaml'],
+         {'async_evals': 60, 'evaluator': 'threads', 'n_workers': 1})
+
+
+def run(root, name, resume):
+    domain, configs, extra = ASYNC if name == 'async' else RUNS[name]
+    p = load_config([CONFIG / c for c in ['x_smoke.yaml', *configs]])
+    p.update(exp_name=name, n_gens=10, save_rate=4, plot_rate=100,
+             print_rate=100, resume=resume, time_phases=True, **extra)
+    logger = RibsLogger(p, copy_config=False, root_path=root)
+    archive = map_elites(domain(**p), p, logger)
+    return archive, logger.log_dir
+
+
+def genomes(archive):
+    solutions = archive._solutions[archive._occupied]
+    if archive.use_objects:
+        return np.array([x.genome for x in solutions[:, 0]])
+    return solutions
+
+
+@pytest.mark.parametrize('name', RUNS)
+def test_resumed_run_matches_uninterrupted(name, tmp_path):
+    """ The run saves its state at iteration 8 and finishes, the resumed one
+    continues from that state and must end the same """
+    full, log_dir = run(tmp_path, name, resume=False)
+    full_metrics = read_metrics(log_dir)[1].copy()
+    full_timings = len(read_metrics(log_dir, name='timings')[1])
+    full_ckpt = load_archive(log_dir / 'archive')['fit']
+
+    resumed, _ = run(tmp_path, name, resume=True)
+    np.testing.assert_array_equal(resumed._occupied, full._occupied)
+    np.testing.assert_array_equal(resumed._objective_values[resumed._occupied],
+                                  full._objective_values[full._occupied])
+    np.testing.assert_array_equal(genomes(resumed), genomes(full))
+    assert resumed.stats == full.stats
+    np.testing.assert_array_equal(read_metrics(log_dir)[1], full_metrics)
+    assert len(read_metrics(log_dir, name='timings')[1]) == full_timings
+    np.testing.assert_array_equal(load_archive(log_dir / 'archive')['fit'],
+                                  full_ckpt)
+
+
+def test_resumed_async_run(tmp_path):
+    """ Batches in flight when the state was saved are asked again, so the
+    resumed run only keeps the logs up to the state """
+    _, log_dir = run(tmp_path, 'async', resume=False)
+    full_metrics = read_metrics(log_dir)[1].copy()
+    resumed, _ = run(tmp_path, 'async', resume=True)
+    metrics = read_metrics(log_dir)[1]
+    assert len(metrics) == len(full_metrics)
+    np.testing.assert_array_equal(metrics[:8], full_metrics[:8])
+    assert resumed.stats.num_elites >= metrics[7, 1]
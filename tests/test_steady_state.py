@@ -0,0 +1,56 @@
+""" Steady state loop (`async_evals`) asking emitters while batches are in flight
+"""
+from pathlib import Path
+
+import matplotlib
+
+from bbq.emitters._init_emitter import emitter_lookup
+from bbq.emitters._standard_emitters import Bbq_Cma, Bbq_Line
+from bbq.examples.rastrigin import Rastrigin
+from bbq.logging.logger import RibsLogger
+from bbq.map_elites import map_elites
+from bbq.utils import load_config
+
+matplotlib.use('Agg')
+CONFIG = Path(__file__).parent.parent / 'config'
+
+
+def counting(emitter_type):
+    """ Emitter type that counts its batches asked but not told yet """
+    class Counting(emitter_type):
+        made = []
+        in_flight = most_in_flight = told = 0
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.made.append(self)
+
+        def ask(self):
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            return super().ask()
+
+        def tell(self, *args, **kwargs):
+            self.in_flight -= 1
+            self.told += 1
+            return super().tell(*args, **kwargs)
+    return Counting
+
+
+def test_cma_has_one_batch_in_flight(tmp_path):
+    """ With more evaluations in flight than the emitters ask per generation
+    only the line emitter is asked ahead """
+    p = load_config([CONFIG / c for c in
+                     ['d_rast.yaml', 'x_smoke.yaml', 'e_mixed.yaml']])
+    p.update(n_gens=10, plot_rate=100, save_rate=100, print_rate=100,
+             async_evals=400, evaluator='threads', n_workers=2)
+    lookup = {**emitter_lookup, 'Cma': counting(Bbq_Cma),
+              'Line': counting(Bbq_Line)}
+    logger = RibsLogger(p, copy_config=False, root_path=tmp_path)
+    map_elites(Rastrigin(**p), p, logger, emitter_lookup=lookup)
+
+    (cma,), (line,) = lookup['Cma'].made, lookup['Line'].made
+    assert cma.most_in_flight == 1
+    assert line.most_in_flight > 1
+    assert cma.told == line.told == p['n_gens']
+    assert cma.in_flight == line.in_flight == 0